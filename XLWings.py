@@ -6,11 +6,10 @@ import numpy as np
 from convert_units import convert_pressure
 from convert_units import convert_temperature
 from convert_units import convert_volume
+from convert_units import get_converter
 from calculate_moles import get_z
 from calculate_moles import get_rhom
-from scipy.optimize import curve_fit
-from isotherm_models import linear
-from isotherm_models import langmuir
+from isotherm_fitting import fit_isotherm
 from kinetic_models import cj_analytical_edge_concentration
 
 
@@ -86,37 +85,108 @@ def absolute_surface(gas, rho_ads, temperature, pressure, excess):
     return absolute
 
 
+def _broadcast_columns(*values):
+    """broadcast excel ranges (or single cells) to equal length 1d arrays"""
+    return np.broadcast_arrays(*(np.asarray(v, dtype=float).ravel() for v in values))
+
+def _column(values):
+    return np.asarray(values).reshape(-1, 1)
+
 @xw.func
-@xw.arg('P', np.array)
-@xw.arg('n', np.array)
+@xw.arg('input_value', np.array, ndim=1)
 @xw.ret(expand='table')
-def linear_fit(P, n):
+def pressure_conversion_array(input_value, input_units, output_units):
+    return _column(get_converter(input_units, output_units)(input_value))
+
+@xw.func
+@xw.arg('Vr', np.array, ndim=1)
+@xw.arg('Vs', np.array, ndim=1)
+@xw.arg('Pi', np.array, ndim=1)
+@xw.arg('Pc', np.array, ndim=1)
+@xw.arg('Pe', np.array, ndim=1)
+@xw.arg('Wsh', np.array, ndim=1)
+@xw.ret(expand='table')
+def calibrate_specific_volume_array(Vr,Vs,Pi,Pc,Pe,Wsh):
+    Vr,Vs,Pi,Pc,Pe,Wsh = _broadcast_columns(Vr,Vs,Pi,Pc,Pe,Wsh)
+    return _column(calibrate_specific_volume(Vr,Vs,Pi,Pc,Pe,Wsh))
+
+@xw.func
+@xw.arg('pressure', np.array, ndim=1)
+@xw.arg('volume', np.array, ndim=1)
+@xw.arg('temperature', np.array, ndim=1)
+@xw.ret(expand='table')
+def moles_array(pressure, volume, temperature, gas):
+    pressure, volume, temperature = _broadcast_columns(pressure, volume, temperature)
+    return _column(moles(pressure, volume, temperature, gas))
+
+@xw.func
+@xw.arg('reference_volume', np.array, ndim=1)
+@xw.arg('temperature', np.array, ndim=1)
+@xw.arg('initial_pressure', np.array, ndim=1)
+@xw.arg('charge_pressure', np.array, ndim=1)
+@xw.arg('previously_injected', np.array, ndim=1)
+@xw.ret(expand='table')
+def inject_array(gas,reference_volume,temperature,initial_pressure,charge_pressure,previously_injected):
+    columns = _broadcast_columns(reference_volume,temperature,initial_pressure,charge_pressure,previously_injected)
+    return _column(inject(gas, *columns))
+
+@xw.func
+@xw.arg('rho_ads', np.array, ndim=1)
+@xw.arg('temperature', np.array, ndim=1)
+@xw.arg('pressure', np.array, ndim=1)
+@xw.arg('excess', np.array, ndim=1)
+@xw.ret(expand='table')
+def absolute_surface_array(gas, rho_ads, temperature, pressure, excess):
+    rho_ads, temperature, pressure, excess = _broadcast_columns(rho_ads, temperature, pressure, excess)
+    return _column(absolute_surface(gas, rho_ads, temperature, pressure, excess))
 
-    popt = curve_fit(linear,P,n)
-    K = popt[0][0]
 
-    sq_er = [(linear(p,K) - a)**2 for (p,a) in zip(P,n)]
+@xw.func
+@xw.arg('temperature', np.array, ndim=1)
+@xw.arg('initial_pressure', np.array, ndim=1)
+@xw.arg('charge_pressure', np.array, ndim=1)
+@xw.arg('equilibrium_pressure', np.array, ndim=1)
+@xw.ret(expand='table')
+def inject_sequence(gas, reference_volume, void_volume, temperature, initial_pressure,
+                    charge_pressure, equilibrium_pressure, rho_ads=None):
+    """cumulative injected, excess and (with rho_ads) absolute moles for a whole run"""
+    from manometric_reduction import reduce_injections
+
+    Vr = convert_volume(reference_volume, 'ml', 'm3')
+    Vv = convert_volume(void_volume, 'ml', 'm3')
+    T, Pi, Pc, Pe = _broadcast_columns(temperature, initial_pressure, charge_pressure, equilibrium_pressure)
+    T = get_converter('degC','K')(T)
+    to_Pa = get_converter('bar_a','Pa_a')
 
-    rss = sum(sq_er)
+    reduced = reduce_injections(gas, Vr, Vv, T, to_Pa(Pi), to_Pa(Pc), to_Pa(Pe), rho_ads)
 
-    return np.array([K, rss])
+    if rho_ads is None:
+        return np.column_stack([reduced['injected'], reduced['excess']])
+    return np.column_stack([reduced['injected'], reduced['excess'], reduced['absolute']])
 
 
 @xw.func
 @xw.arg('P', np.array)
 @xw.arg('n', np.array)
 @xw.ret(expand='table')
-def langmuir_fit(P, n):
+def linear_fit(P, n):
 
-    popt = curve_fit(langmuir,P,n)
-    VL = popt[0][0]
-    PL = popt[0][1]
+    fit = fit_isotherm('linear', P, n)
+    K = fit['params'][0]
 
-    sq_er = [(langmuir(p,VL,PL) - a)**2 for (p,a) in zip(P,n)]
+    return np.array([K, fit['rss']])
+
+
+@xw.func
+@xw.arg('P', np.array)
+@xw.arg('n', np.array)
+@xw.ret(expand='table')
+def langmuir_fit(P, n):
 
-    rss = sum(sq_er)
+    fit = fit_isotherm('langmuir', P, n)
+    VL, PL = fit['params']
 
-    return np.array([VL, PL, rss])
+    return np.array([VL, PL, fit['rss']])
 
 @xw.func
 def carlslaw_analytical_solution(t,rho_c0,rho_i,Kc,K,Ra,n):
@@ -0,0 +1,244 @@
+"""
+benchmarks of the numerical hot paths with json regression baselines
+
+Every case times one call with realistic inputs (a scalar, 1e6 element
+arrays or 1k datasets) and reports the best of several repeats. Cases whose
+dependencies are missing are skipped.
+
+    python benchmarks.py --save baseline.json
+    python benchmarks.py --compare baseline.json --threshold 0.25
+
+exits with status 1 when a case is slower than its baseline by more than
+the threshold (a fraction), so it can run continuously in CI.
+"""
+import argparse
+import json
+import sys
+import time
+
+CASES = {}
+
+
+def benchmark(name, elements=1):
+    """register a case; the decorated function does the setup and returns the callable to time"""
+    def register(setup):
+        CASES[name] = (setup, elements)
+        return setup
+    return register
+
+
+@benchmark('roots cold n=99')
+def _roots_cold():
+    from kinetic_models import _cached_analytical_roots, _get_analytical_roots
+
+    def run():
+        _cached_analytical_roots.cache_clear()
+        _get_analytical_roots(2.5, 99)
+    return run
+
+
+@benchmark('roots cached n=99')
+def _roots_cached():
+    from kinetic_models import _get_analytical_roots
+    _get_analytical_roots(2.5, 99)
+    return lambda: _get_analytical_roots(2.5, 99)
+
+
+@benchmark('cj series scalar n=99')
+def _cj_scalar():
+    from kinetic_models import cj_analytical_edge_concentration
+    return lambda: cj_analytical_edge_concentration(3600.0, 150, 30, 2.5, 3e-8, 0.02, 99)
+
+
+def _cj_case(n, tol=None):
+    def setup():
+        import numpy as np
+        from kinetic_models import cj_analytical_edge_concentration
+        t = np.linspace(1, 36000, 10**6)
+        return lambda: cj_analytical_edge_concentration(t, 150, 30, 2.5, 3e-8, 0.02, n, tol=tol)
+    return setup
+
+
+# the error controlled series next to the fixed number of terms it replaces
+for _terms, _n, _tol in (('n=20', 20, None), ('n=99', 99, None), ('tol=1e-3', 99, 1e-3), ('tol=1e-8', 99, 1e-8)):
+    benchmark('cj series 1e6 times {}'.format(_terms), elements=10**6)(_cj_case(_n, _tol))
+
+
+def _moles_case(eos, size):
+    def setup():
+        import numpy as np
+        from calculate_moles import calculate_moles
+        if size == 1:
+            return lambda: calculate_moles(5e6, 1e-4, 318.0, 'methane', eos)
+        P = np.linspace(1e5, 2e7, size)
+        return lambda: calculate_moles(P, 1e-4, 318.0, 'methane', eos)
+    return setup
+
+
+for _eos in ('ideal', 'coolprop', 'vanderWaals', 'RedlichKwong', 'PengRobinson'):
+    benchmark('calculate_moles {} scalar'.format(_eos))(_moles_case(_eos, 1))
+    # a million CoolProp states takes minutes, 1e4 is enough to measure throughput
+    _size = 10**4 if _eos == 'coolprop' else 10**6
+    benchmark('calculate_moles {} {:.0e}'.format(_eos, _size), elements=_size)(_moles_case(_eos, _size))
+
+
+def _get_z_case(backend, size):
+    def setup():
+        import numpy as np
+        from calculate_moles import get_z
+        if size == 1:
+            return lambda: get_z(5e6, 318.0, 'methane', backend)
+        P = np.linspace(1e5, 2e7, size)
+        return lambda: get_z(P, 318.0, 'methane', backend)
+    return setup
+
+
+# pooled AbstractState handles against PropsSI, for a scalar and a batch
+for _backend in ('coolprop', 'state'):
+    benchmark('get_z {} scalar'.format(_backend))(_get_z_case(_backend, 1))
+    benchmark('get_z {} 2e4'.format(_backend), elements=2*10**4)(_get_z_case(_backend, 2*10**4))
+
+
+@benchmark('convert_pressure scalar')
+def _convert_scalar():
+    from convert_units import convert_pressure
+    return lambda: convert_pressure(5.0, 'bar_g', 'Pa_a')
+
+
+@benchmark('convert_pressure 1e6', elements=10**6)
+def _convert_array():
+    import numpy as np
+    from convert_units import convert_pressure
+    P = np.linspace(0, 100, 10**6)
+    return lambda: convert_pressure(P, 'bar_g', 'Pa_a')
+
+
+@benchmark('convert_temperature 1e6', elements=10**6)
+def _convert_temperature():
+    import numpy as np
+    from convert_units import convert_temperature
+    T = np.linspace(0, 100, 10**6)
+    return lambda: convert_temperature(T, 'degC', 'K')
+
+
+def _isotherm_data(model, n_datasets):
+    import numpy as np
+    from isotherm_models import langmuir, linear
+    rng = np.random.default_rng(0)
+    P = np.linspace(1e4, 1e7, 30)
+    datasets = []
+    for _ in range(n_datasets):
+        q = langmuir(P, 1.2, 3e-7) if model == 'langmuir' else linear(P, 2e-7)
+        datasets.append((P, q*(1 + 0.01*rng.standard_normal(P.size))))
+    return datasets
+
+
+def _excel_fit_case(name):
+    def setup():
+        import XLWings
+        fit = getattr(XLWings, name)
+        P, q = _isotherm_data(name.split('_')[0], 1)[0]
+        return lambda: fit(P, q)
+    return setup
+
+
+for _name in ('linear_fit', 'langmuir_fit'):
+    benchmark('XLWings {}'.format(_name))(_excel_fit_case(_name))
+
+
+def _batch_fit_case(model):
+    def setup():
+        from isotherm_fitting import fit_isotherms
+        datasets = _isotherm_data(model, 1000)
+        return lambda: fit_isotherms(model, datasets, processes=1)
+    return setup
+
+
+for _model in ('linear', 'langmuir'):
+    benchmark('fit_isotherms {} 1k datasets'.format(_model), elements=1000)(_batch_fit_case(_model))
+
+
+def time_case(run, repeat=5, min_time=0.2):
+    """best time of one call over repeat rounds, each looping for at least min_time"""
+    run()
+    start = time.perf_counter()
+    run()
+    single = time.perf_counter() - start
+    number = max(1, int(min_time/max(single, 1e-9)))
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        best = min(best, (time.perf_counter() - start)/number)
+    return best
+
+
+def run_benchmarks(pattern='', repeat=5):
+    """time every case whose name contains pattern
+
+    Returns:
+        dict -- case name to {'seconds', 'throughput'}, or {'skipped': reason}
+    """
+    results = {}
+    for name, (setup, elements) in CASES.items():
+        if pattern not in name:
+            continue
+        try:
+            run = setup()
+        except ImportError as error:
+            results[name] = {'skipped': str(error)}
+            continue
+        seconds = time_case(run, repeat)
+        results[name] = {'seconds': seconds, 'throughput': elements/seconds}
+    return results
+
+
+def compare(results, baseline, threshold):
+    """names of the cases slower than the baseline by more than threshold"""
+    regressions = []
+    for name, result in results.items():
+        reference = baseline.get(name, {})
+        if 'seconds' in result and 'seconds' in reference:
+            if result['seconds'] > reference['seconds']*(1 + threshold):
+                regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--save', help='write the results to this json baseline')
+    parser.add_argument('--compare', help='json baseline to check the results against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='allowed slowdown as a fraction of the baseline time')
+    parser.add_argument('--filter', default='', help='only run cases whose name contains this')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.filter, args.repeat)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    width = max((len(name) for name in results), default=0)
+    for name, result in results.items():
+        if 'skipped' in result:
+            print('{:<{}}  skipped ({})'.format(name, width, result['skipped']))
+            continue
+        line = '{:<{}}  {:>12.3e} s  {:>12.3e} /s'.format(name, width, result['seconds'], result['throughput'])
+        if 'seconds' in baseline.get(name, {}):
+            line += '  {:+7.1%}'.format(result['seconds']/baseline[name]['seconds'] - 1)
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print('slower than baseline by more than {:.0%}: {}'.format(args.threshold, ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,74 +1,180 @@
+import instrumentation
+from lazy_imports import lazy_import
+
+CP = lazy_import('CoolProp.CoolProp')
+
+
+@instrumentation.instrument(label=lambda pressure, volume, temperature, gas, eos: '{} {}'.format(gas, eos))
 def calculate_moles(pressure, volume, temperature, gas, eos):
-    import CoolProp.CoolProp as CP
     R = 8.3144598
-    critical_temperature = CP.PropsSI('TCRIT', gas)
-    reduced_temperature = temperature / critical_temperature
-    critical_pressure = CP.PropsSI('PCRIT', gas)
-    acentric = CP.PropsSI('ACENTRIC', gas)
-    vanderWaalsconstants = {
-        'methane': [0.2283,4.278e-05],
-        'carbondioxide': [0.364,4.267e-05],
-        'helium':[0.00346,2.3800000000000003e-05]
-    }
     n_init = (pressure*volume)/(R*temperature)
     if eos == 'ideal':
         moles = n_init
     elif eos == 'coolprop':
         z = CP.PropsSI('Z','P',pressure,'T',temperature,gas)
         moles = n_init/z
-    elif eos == 'vanderWaals':
-        a,b = vanderWaalsconstants.get(gas,'invalideos')
-        n_old = 0
-        n_new = n_init
-        while not ((0.9999*n_new)<n_old<(1.0001*n_new)):
-            n_old = n_new
-            n_new = ((pressure*volume)/(R*temperature))*\
-            (1 + ((n_new**2 * a)/(pressure * volume**2)))*\
-            (1 - (n_new*b/volume))
-        moles = n_new
-    elif eos == 'RedlichKwong':
+    elif eos in ('vanderWaals', 'RedlichKwong', 'PengRobinson'):
+        moles = cubic_eos_moles(pressure, volume, temperature, gas, eos)
+    return moles
+
+def _cubic_eos_parameters(temperature, gas, eos):
+    """attraction a, co-volume b, sigma and epsilon of the generic cubic
+    P = RT/(Vm - b) - a/((Vm + epsilon*b)*(Vm + sigma*b))
+    """
+    from fluid_constants import get_fluid_constants
+    R = 8.3144598
+    constants = get_fluid_constants(gas)
+    if eos == 'vanderWaals':
+        if constants.vanderwaals_a is None:
+            raise ValueError('no van der Waals constants for {}'.format(gas))
+        return constants.vanderwaals_a, constants.vanderwaals_b, 0, 0
+    critical_temperature = constants.critical_temperature
+    critical_pressure = constants.critical_pressure
+    reduced_temperature = temperature / critical_temperature
+    if eos == 'RedlichKwong':
         alpha = reduced_temperature ** (-0.5)
         Xi = 0.42748
         Omega = 0.08664
-        a = (Xi * alpha * (R ** 2) * (critical_temperature ** 2)) / (critical_pressure)
-        b = (Omega * R * critical_temperature) / (critical_pressure)
         sigma = 1
         epsilon = 0
-        n_old = 0
-        n_new = n_init
-        Vm = volume / n_init
-        while not ((0.9999 * n_new) < n_old < (1.0001 * n_new)):
-            n_old = n_new
-            Vm = (R * temperature / pressure) + b - (a / pressure) * (Vm - b) / (
-                    (Vm + epsilon * b) * (Vm + sigma * b))
-            n_new = volume / Vm
-        moles = n_new
     elif eos == 'PengRobinson':
+        acentric = constants.acentric
         alpha = (1 + (0.37464 + 1.54226 * acentric - 0.26992 * (acentric ** 2)) * (
                     1 - reduced_temperature ** (0.5))) ** 2
         Xi = 0.45724
         Omega = 0.0778
-        a = (Xi * alpha * (R ** 2) * (critical_temperature ** 2)) / (critical_pressure)
-        b = (Omega * R * critical_temperature) / (critical_pressure)
         sigma = 1 + 2 ** (0.5)
         epsilon = 1 - 2 ** (0.5)
-        n_old = 0
-        n_new = n_init
-        Vm = volume / n_init
-        while not ((0.9999 * n_new) < n_old < (1.0001 * n_new)):
-            n_old = n_new
-            Vm = (R * temperature / pressure) + b - (a / pressure) * (Vm - b) / (
-                    (Vm + epsilon * b) * (Vm + sigma * b))
-            n_new = volume / Vm
-        moles = n_new
+    else:
+        raise ValueError('invalid cubic eos {}'.format(eos))
+    a = (Xi * alpha * (R ** 2) * (critical_temperature ** 2)) / (critical_pressure)
+    b = (Omega * R * critical_temperature) / (critical_pressure)
+    return a, b, sigma, epsilon
+
+def solve_cubic_eos(pressure, temperature, a, b, sigma, epsilon, tol=1e-12, max_iter=20):
+    """solve the compressibility cubic of a generic cubic equation of state
+    
+    The cubic is solved in closed form over whole arrays, the root with the
+    lowest fugacity (the stable phase) is kept among those with Vm > b, and
+    it is then polished with a safeguarded newton step.
+    
+    Arguments:
+        pressure {array_like} -- pressure Pa
+        temperature {array_like} -- temperature K
+        a {array_like} -- attraction parameter Pa m^6/mol^2
+        b {array_like} -- co-volume m^3/mol
+        sigma {float} -- cubic eos sigma
+        epsilon {float} -- cubic eos epsilon
+    
+    Keyword Arguments:
+        tol {float} -- relative tolerance on Z (default: {1e-12})
+        max_iter {int} -- maximum number of newton steps (default: {20})
+    
+    Returns:
+        tuple -- (compressibility factor, newton iterations per point)
+    """
+    import numpy as np
+    R = 8.3144598
+    P, T, a, b = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (pressure, temperature, a, b)))
+    A = a*P/(R*T)**2
+    B = b*P/(R*T)
+    c2 = (epsilon + sigma - 1)*B - 1
+    c1 = epsilon*sigma*B**2 - (epsilon + sigma)*B*(1 + B) + A
+    c0 = -(epsilon*sigma*B**2*(1 + B) + A*B)
+
+    # closed form roots of the depressed cubic x^3 + p*x + q with Z = x - c2/3
+    p = c1 - c2**2/3
+    q = 2*c2**3/27 - c2*c1/3 + c0
+    discriminant = (q/2)**2 + (p/3)**3
+    with np.errstate(invalid='ignore', divide='ignore'):
+        root_discriminant = np.sqrt(np.maximum(discriminant, 0))
+        single = np.cbrt(-q/2 + root_discriminant) + np.cbrt(-q/2 - root_discriminant)
+        m = 2*np.sqrt(np.maximum(-p/3, 0))
+        angle = np.arccos(np.clip(3*q/(p*m), -1, 1))/3
+        k = np.arange(3).reshape((3,) + (1,)*P.ndim)
+        triple = m*np.cos(angle - 2*np.pi*k/3)
+    three_real = (discriminant < 0)
+    candidates = np.where(three_real, triple, np.where(k == 0, single, np.nan)) - c2/3
+
+    # keep the physical root with the lowest fugacity coefficient
+    with np.errstate(invalid='ignore', divide='ignore'):
+        valid = candidates > B
+        if sigma == epsilon:
+            I = B/(candidates + epsilon*B)
+        else:
+            I = np.log((candidates + sigma*B)/(candidates + epsilon*B))/(sigma - epsilon)
+        ln_phi = candidates - 1 - np.log(candidates - B) - (A/B)*I
+    ln_phi = np.where(valid, ln_phi, np.inf)
+    Z = np.take_along_axis(candidates, np.argmin(ln_phi, axis=0)[np.newaxis], axis=0)[0]
+
+    iterations = np.zeros(Z.shape, dtype=int)
+    active = np.isfinite(Z)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        f = ((Z + c2)*Z + c1)*Z + c0
+        df = (3*Z + 2*c2)*Z + c1
+        with np.errstate(invalid='ignore', divide='ignore'):
+            step = np.where(active & (df != 0), f/df, 0)
+        Z_new = Z - step
+        # never step across the co-volume
+        Z_new = np.where(Z_new > B, Z_new, Z)
+        iterations += active
+        active = active & (np.abs(Z_new - Z) > tol*np.abs(Z_new))
+        Z = Z_new
+    return Z, iterations
+
+def cubic_eos_moles(pressure, volume, temperature, gas, eos, full_output=False):
+    """calculate moles with a cubic equation of state over numpy arrays
+    
+    Arguments:
+        pressure {array_like} -- pressure Pa
+        volume {array_like} -- volume m^3
+        temperature {array_like} -- temperature K
+        gas {str} -- CoolProp fluid name
+        eos {str} -- vanderWaals, RedlichKwong or PengRobinson
+    
+    Keyword Arguments:
+        full_output {bool} -- also return the newton iterations per point (default: {False})
+    
+    Returns:
+        float or numpy array -- moles, or (moles, iterations) if full_output
+    """
+    import numpy as np
+    R = 8.3144598
+    a, b, sigma, epsilon = _cubic_eos_parameters(temperature, gas, eos)
+    z, iterations = solve_cubic_eos(pressure, temperature, a, b, sigma, epsilon)
+    instrumentation.record_iterations('calculate_moles.calculate_moles', np.sum(iterations), '{} {}'.format(gas, eos))
+    moles = (pressure*volume)/(z*R*temperature)
+    if np.ndim(moles) == 0:
+        moles = float(moles)
+        iterations = int(iterations)
+    if full_output:
+        return moles, iterations
     return moles
 
-def get_z(pressure, temperature, gas):
-    import CoolProp.CoolProp as CP
+@instrumentation.instrument(label=lambda pressure, temperature, gas, backend='coolprop': '{} {}'.format(gas, backend))
+def get_z(pressure, temperature, gas, backend='coolprop'):
+    """compressibility factor; backend 'table' interpolates a cached property table,
+    'state' evaluates with pooled CoolProp AbstractState handles"""
+    if backend == 'table':
+        from property_tables import table_z
+        return table_z(pressure, temperature, gas)
+    if backend == 'state':
+        from property_service import state_z
+        return state_z(pressure, temperature, gas)
     z = CP.PropsSI('Z','P',pressure,'T',temperature,gas)
     return z
 
-def get_rhom(pressure, temperature, gas):
-    import CoolProp.CoolProp as CP
+@instrumentation.instrument(label=lambda pressure, temperature, gas, backend='coolprop': '{} {}'.format(gas, backend))
+def get_rhom(pressure, temperature, gas, backend='coolprop'):
+    """molar density mol/m^3; backend 'table' interpolates a cached property table,
+    'state' evaluates with pooled CoolProp AbstractState handles"""
+    if backend == 'table':
+        from property_tables import table_rhom
+        return table_rhom(pressure, temperature, gas)
+    if backend == 'state':
+        from property_service import state_rhom
+        return state_rhom(pressure, temperature, gas)
     rhom = CP.PropsSI('DMOLAR','P',pressure,'T',temperature,gas)
-    return rhom
\ No newline at end of file
+    return rhom
@@ -1,214 +1,237 @@
+from functools import lru_cache
+
+
+_PRESSURE_INDEX = {
+    'Pa':0,
+    'bar':1,
+    'atm':2,
+    'psi':3,
+    'torr':4,
+    'g':5,
+    'a':6
+}
+
+_PRESSURE_MATRIX = [
+    [1, 1.00000000000000e-05, 9.86923266716000e-06, \
+     0.000145037891149100, 0.00750061682704200, 101325, 0],
+    [100000, 1, 0.986923266716000, 14.5037891149100, \
+     750.061682704200, 1.01325000000000, 0],
+    [101325, 1.01325000000000, 1, 14.6959643206800, 760, 1, 0],
+    [6894.75000000000, 0.0689475000000000, 0.0680458919319000, \
+     1, 51.7148778682500, 14.6959500000000, 0],
+    [133.322368421100, 0.00133322368421100, 0.00131578947368400, \
+     0.0193367951587900, 1, 760.002100000000, 0]
+]
+
+_TEMPERATURE_INDEX = {
+    'degC':0,
+    'degF':1,
+    'K':2
+}
+
+# (scale, offset) of every pair, composed once so no conversion rounds through kelvin
+_TEMPERATURE_MAPS = {
+    ('degC', 'degC'): (1, 0),
+    ('degC', 'degF'): (9 / 5, 32),
+    ('degC', 'K'): (1, 273.15),
+    ('degF', 'degC'): (5 / 9, -32 * 5 / 9),
+    ('degF', 'degF'): (1, 0),
+    ('degF', 'K'): (5 / 9, 459.67 * 5 / 9),
+    ('K', 'degC'): (1, -273.15),
+    ('K', 'degF'): (9 / 5, -459.67),
+    ('K', 'K'): (1, 0)
+}
+
+_VOLUME_INDEX = {
+    'm3':0,
+    'l':1,
+    'ml':2,
+    'ft3':3
+}
+
+_VOLUME_MATRIX = [
+    [1, 1000, 1000000, 35.3146667000000],
+    [0.00100000000000000, 1, 1000, 0.0353146667000000],
+    [1.00000000000000e-06, 0.00100000000000000, 1, 3.53146667000000e-05],
+    [0.0283168466000000, 28.3168466000000, 28316.8466000000, 1]
+]
+
+_WEIGHT_INDEX = {
+    'kg': 0,
+    'g': 1,
+    'mg': 2,
+    'lb': 3,
+    'ton': 4,
+    'USton': 5
+}
+
+_WEIGHT_MATRIX = [
+    [1,1000,1000000,2.20462,0.001,0.00110231],
+    [0.001,1,1000,0.00220462,1.00e-06,1.10230e-06],
+    [1.00e-06,0.001,1,2.20460e-6,1.00e-9,1.10230e-09],
+    [0.453592,453.592,453592,1,0.000453592,0.0005],
+    [1000,1.0e6,1.0e9,2204.62,1,1.10231],
+    [907.185,907185,9.07185e8,2000,0.907185,1]
+]
+
+_MOLE_INDEX = {
+    'mol':0,
+    'mmol':1,
+    'SCCM':2,
+    'SCF':3
+}
+
+_MOLE_MATRIX = [
+    [1, 1000, 24710.480, 1.883943106091513], # 0.986923266716*70*24.710480*0.03531467/32
+    [0.001, 1, 24.710480, 0.001883943106091513],
+    [1 / 24710.480, 1 / 24.710480, 1, 0.076240651986182], #0.986923266716*70*0.03531467/32
+    [1 / 1.883943106091513, 530.8015920261154, 13.116362123729489, 1]
+]
+
+_TIME_INDEX = {
+    'sec': 0,
+    'min' : 1,
+    'hr' : 2,
+    'day' :3
+}
+
+_TIME_MATRIX = [
+    [1,0.0166666666666667,2.777777777777778e-4,1.157407407407407e-5],
+    [60,1,0.0166666666666667,6.944444444444444e-4],
+    [3600,60,1,0.0416666666666667],
+    [86400,1440,24,1]
+]
+
+_SCALE_TABLES = [
+    (_VOLUME_INDEX, _VOLUME_MATRIX),
+    (_WEIGHT_INDEX, _WEIGHT_MATRIX),
+    (_MOLE_INDEX, _MOLE_MATRIX),
+    (_TIME_INDEX, _TIME_MATRIX)
+]
+
+
+class UnitConverter:
+    """affine unit conversion output = scale*input + offset
+
+    Arguments:
+        scale {float} -- multiplicative factor
+        offset {float} -- additive offset in output units
+    """
+
+    def __init__(self, scale, offset=0):
+        self.scale = scale
+        self.offset = offset
+
+    def __call__(self, input_value, out=None):
+        """convert a scalar or numpy array
+
+        Arguments:
+            input_value {float or numpy array} -- value in input units
+
+        Keyword Arguments:
+            out {numpy array} -- array to write into, may be input_value itself (default: {None})
+
+        Returns:
+            float or numpy array -- value in output units
+        """
+        if out is None:
+            if self.offset == 0:
+                return input_value * self.scale
+            return input_value * self.scale + self.offset
+        import numpy as np
+        np.multiply(input_value, self.scale, out=out)
+        if self.offset != 0:
+            np.add(out, self.offset, out=out)
+        return out
+
+    def __repr__(self):
+        return 'UnitConverter(scale={!r}, offset={!r})'.format(self.scale, self.offset)
+
+
+def _pressure_converter(input_units, output_units):
+    index = _PRESSURE_INDEX
+    matrix = _PRESSURE_MATRIX
+    si = input_units.split("_")
+    so = output_units.split("_")
+    # rows of the matrix are the pressure units, the last two columns the gauge and absolute references
+    valid = lambda s: len(s) == 2 and s[0] in index and index[s[0]] < len(matrix) and s[1] in ('g', 'a')
+    if not (valid(si) and valid(so)):
+        raise ValueError('invalid pressure units {} -> {}'.format(input_units, output_units))
+    scale = matrix[index[si[0]]][index[so[0]]]
+    offset = matrix[index[si[0]]][index[si[1]]] * scale - matrix[index[so[0]]][index[so[1]]]
+    return UnitConverter(scale, offset)
+
+
+@lru_cache(maxsize=None)
+def get_converter(input_units, output_units):
+    """parse a unit pair once and return a reusable converter
+
+    Pressure units are written unit_reference, e.g. 'bar_g' or 'Pa_a'.
+
+    Arguments:
+        input_units {str} -- units of the input values
+        output_units {str} -- units of the output values
+
+    Raises:
+        ValueError -- if the units are unknown or of different quantities
+
+    Returns:
+        UnitConverter -- callable applying scale*value + offset
+    """
+    if '_' in input_units or '_' in output_units:
+        return _pressure_converter(input_units, output_units)
+    if (input_units, output_units) in _TEMPERATURE_MAPS:
+        return UnitConverter(*_TEMPERATURE_MAPS[(input_units, output_units)])
+    for index, matrix in _SCALE_TABLES:
+        if input_units in index and output_units in index:
+            return UnitConverter(matrix[index[input_units]][index[output_units]])
+    raise ValueError('invalid units {} -> {}'.format(input_units, output_units))
+
+
 def _get_pressure_index_():
-    p_index = {
-        'Pa':0,
-        'bar':1,
-        'atm':2,
-        'psi':3,
-        'torr':4,
-        'g':5,
-        'a':6
-    }
-    return p_index
+    return _PRESSURE_INDEX
 
 def _get_pressure_matrix_():
-    p_matrix = [
-                [1, 1.00000000000000e-05, 9.86923266716000e-06, \
-                 0.000145037891149100, 0.00750061682704200, 101325, 0],
-                [100000, 1, 0.986923266716000, 14.5037891149100, \
-                 750.061682704200, 1.01325000000000, 0],
-                [101325, 1.01325000000000, 1, 14.6959643206800, 760, 1, 0],
-                [6894.75000000000, 0.0689475000000000, 0.0680458919319000, \
-                 1, 51.7148778682500, 14.6959500000000, 0],
-                [133.322368421100, 0.00133322368421100, 0.00131578947368400, \
-                 0.0193367951587900, 1, 760.002100000000, 0]
-                ]
-    return p_matrix
+    return _PRESSURE_MATRIX
 
 def convert_pressure(input_value, input_units, output_units):
-
-    matrix = _get_pressure_matrix_()
-    index = _get_pressure_index_()
-
-
-    si = input_units.split("_");
-    so = output_units.split("_");
-
-    if not si[0] in index.keys() and so[0] in index.keys():
-        print('invalid pressure units')
-
-    absolute_input_value = input_value + matrix[index[si[0]]][index[si[1]]];
-    converted_input_value = absolute_input_value * matrix[index[si[0]]][index[so[0]]];
-    output_value = converted_input_value - matrix[index[so[0]]][index[so[1]]];
-    return output_value
+    return get_converter(input_units, output_units)(input_value)
 
 def _get_temperature_index_():
-    t_index = {
-        'degC':0,
-        'degF':1,
-        'K':2
-    }
-    return t_index
+    return _TEMPERATURE_INDEX
 
 def convert_temperature(input_value, input_units, output_units):
-    if input_units == 'degC':
-        if output_units == 'degC':
-            output_value =  input_value * 1
-        elif output_units == 'degF':
-            output_value = (input_value * 9 / 5) + 32
-        elif output_units == 'K':
-            output_value = input_value + 273.15
-    elif input_units == 'degF':
-        if output_units == 'degC':
-            output_value =  (input_value - 32) * 5 / 9
-        elif output_units == 'degF':
-            output_value = input_value * 1
-        elif output_units == 'K':
-            output_value = (input_value + 459.67) * 5 / 9,
-    elif input_units == 'K':
-        if output_units == 'degC':
-            output_value =  input_value - 273.15
-        elif output_units == 'degF':
-            output_value = (input_value * 9 / 5) - 459.67
-        elif output_units == 'K':
-            output_value = input_value * 1
-    return output_value
+    return get_converter(input_units, output_units)(input_value)
 
 def _get_volume_index_():
-    v_index = {
-        'm3':0,
-        'l':1,
-        'ml':2,
-        'ft3':3
-    }
-    return v_index
+    return _VOLUME_INDEX
 
 def _get_volume_matrix_():
-    v_matrix = [
-                [1, 1000, 1000000, 35.3146667000000],
-                [0.00100000000000000, 1, 1000, 0.0353146667000000],
-                [1.00000000000000e-06, 0.00100000000000000, 1, 3.53146667000000e-05],
-                [0.0283168466000000, 28.3168466000000, 28316.8466000000, 1]
-               ]
-    return v_matrix
+    return _VOLUME_MATRIX
 
 def convert_volume(input_value, input_units, output_units):
-
-    index = _get_volume_index_()
-    matrix = _get_volume_matrix_()
-
-    if not input_units in index.keys() and output_units in index.keys():
-        print('invalid volume units')
-
-    output_value = input_value * matrix[index[input_units]][index[output_units]]
-    return output_value
+    return get_converter(input_units, output_units)(input_value)
 
 def _get_weight_index_():
-    w_index = {
-        'kg': 0,
-        'g': 1,
-        'mg': 2,
-        'lb': 3,
-        'ton': 4,
-        'USton': 5
-    }
-    return w_index
+    return _WEIGHT_INDEX
 
 def _get_weight_matrix_():
-    w_matrix = [
-        [1,1000,1000000,2.20462,0.001,0.00110231],
-        [0.001,1,1000,0.00220462,1.00e-06,1.10230e-06],
-        [1.00e-06,0.001,1,2.20460e-6,1.00e-9,1.10230e-09],
-        [0.453592,453.592,453592,1,0.000453592,0.0005],
-        [1000,1.0e6,1.0e9,2204.62,1,1.10231],
-        [907.185,907185,9.07185e8,2000,0.907185,1]
-    ]
-    return w_matrix
+    return _WEIGHT_MATRIX
 
 def convert_weight(input_value, input_units, output_units):
-
-    index = _get_weight_index_()
-    matrix = _get_weight_matrix_()
-
-    if not input_units in index.keys() and output_units in index.keys():
-        print('invalid units')
-
-    output_value = input_value * matrix[index[input_units]][index[output_units]]
-    return output_value
+    return get_converter(input_units, output_units)(input_value)
 
 def _get_mole_index_():
-    m_index = {
-        'mol':0,
-        'mmol':1,
-        'SCCM':2,
-        'SCF':3
-    }
-    return m_index
+    return _MOLE_INDEX
 
 def convert_moles(input_value, input_units, output_units):
-    if input_units == 'mol':
-        if output_units == 'mol':
-            output_value = input_value * 1
-        elif output_units == 'mmol':
-            output_value = input_value * 1000
-        elif output_units == 'SCCM':
-            output_value = input_value * 24710.480
-        elif output_units == 'SCF':
-            output_value = input_value * 1.883943106091513; # 0.986923266716*70*24.710480*0.03531467/32
-    elif input_units == 'mmol':
-        if output_units == 'mol':
-            output_value = input_value * 1000;
-        elif output_units == 'mmol':
-            output_value = input_value * 1;
-        elif output_units == 'SCCM':
-            output_value = input_value * 24.710480;
-        elif output_units == 'SCF':
-            output_value = input_value * 0.001883943106091513;
-    elif input_units == 'SCCM':
-        if output_units == 'mol':
-            output_value = input_value / 24710.480;
-        elif output_units == 'mmol':
-            output_value = input_value / 24.710480;
-        elif output_units == 'SCCM':
-            output_value = input_value * 1;
-        elif output_units == 'SCF':
-            output_value = input_value * 0.076240651986182; #0.986923266716*70*0.03531467/32
-    elif input_units == 'SCF':
-        if output_units == 'mol':
-            output_value = input_value / 1.883943106091513; # 0.986923266716*70*24.710480*0.03531467/32
-        elif output_units == 'mmol':
-            output_value = input_value * 530.8015920261154;
-        elif output_units == 'SCCM':
-            output_value = input_value * 13.116362123729489;
-        elif output_units == 'SCF':
-            output_value = input_value * 1;
-    return output_value
+    return get_converter(input_units, output_units)(input_value)
 
 def _get_time_index_():
-    t_index = {
-        'sec': 0,
-        'min' : 1,
-        'hr' : 2,
-        'day' :3
-    }
-    return t_index
+    return _TIME_INDEX
 
 def _get_time_matrix_():
-    t_matrix = [
-        [1,0.0166666666666667,2.777777777777778e-4,1.157407407407407e-5],
-        [60,1,0.0166666666666667,6.944444444444444e-4],
-        [3600,60,1,0.0416666666666667],
-        [86400,1440,24,1]
-    ]
-    return t_matrix
+    return _TIME_MATRIX
 
 def convert_time(input_value, input_units, output_units):
-
-    index = _get_time_index_()
-    matrix = _get_time_matrix_()
-
-    if not input_units in index.keys() and output_units in index.keys():
-        print('invalid time units')
-
-    output_value = input_value * matrix[index[input_units]][index[output_units]]
-    return output_value
-
+    return get_converter(input_units, output_units)(input_value)
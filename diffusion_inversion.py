@@ -0,0 +1,161 @@
+"""
+fit diffusivity and storage ratio to measured edge pressure decay
+
+The edge concentration of the Carslaw Jaeger solution (kinetic_models) is
+
+    rho(t) = rho_c0 - D/(Kc + 1) + 6*Kc*D*sum_j w_j*exp(-alpha_j^2*K*t/Ra^2)
+
+with D = rho_c0 - rho_i and w_j = 1/(Kc^2*alpha_j^2 + 9*(Kc + 1)). It is
+fitted in ln(K) and ln(Kc), which keeps both positive and evens out their
+scales, with the jacobian differentiated analytically, including the
+movement of the eigenvalues with Kc,
+
+    dalpha/dKc = -alpha^2*sin(alpha)/f'(alpha)
+
+The j-th eigenvalue always lies in (j*pi, j*pi + pi/2), so the roots for a
+new Kc are polished from those brackets without a scan and memoized. Starts
+are picked by evaluating the whole (K, Kc) grid at once and polished with
+scipy.optimize.least_squares, across a process pool if asked
+(least_squares_fitting.map_fits).
+"""
+from functools import lru_cache
+
+from kinetic_models import polish_roots, root_function_derivative, cj_analytical_edge_concentration_grid
+from least_squares_fitting import least_squares_with_stats, map_fits
+
+
+@lru_cache(maxsize=256)
+def _eigenvalues(Kc, n):
+    """roots of the eigenvalue equation and their derivatives with respect to Kc"""
+    import numpy as np
+    lo = np.pi*np.arange(1, n + 1)
+    alpha = polish_roots(lo, lo + np.pi/2, Kc)
+    dalpha = -alpha**2*np.sin(alpha)/root_function_derivative(alpha, Kc)
+    alpha.setflags(write=False)
+    dalpha.setflags(write=False)
+    return alpha, dalpha
+
+
+def _model(x, t, rho_c0, rho_i, Ra, n):
+    """edge concentration and its jacobian with respect to (ln K, ln Kc)"""
+    import numpy as np
+    K, Kc = np.exp(x)
+    alpha, dalpha = _eigenvalues(float(Kc), n)
+    step = rho_c0 - rho_i
+    tau = K*t/Ra**2
+    w = 1/(Kc**2*alpha**2 + 9*(Kc + 1))
+    dw = -w**2*(2*Kc*alpha**2 + 2*Kc**2*alpha*dalpha + 9)
+    E = np.exp(-tau[:, None]*alpha**2)
+    S = E @ w
+    rho = rho_c0 - step/(Kc + 1) + 6*Kc*step*S
+    d_lnK = 6*Kc*step*(-(tau[:, None]*alpha**2*E) @ w)
+    d_Kc = (step/(Kc + 1)**2 + 6*step*S
+            + 6*Kc*step*(E @ dw - 2*tau*((E*alpha*dalpha) @ w)))
+    return rho, np.column_stack([d_lnK, Kc*d_Kc])
+
+
+def _polish(task):
+    start, t, rho, rho_c0, rho_i, Ra, n = task
+
+    def residual_and_jacobian(x):
+        model, jacobian = _model(x, t, rho_c0, rho_i, Ra, n)
+        return model - rho, jacobian
+
+    return least_squares_with_stats(residual_and_jacobian, start)
+
+
+def _grid_starts(t, rho, rho_c0, rho_i, Ra, n, n_grid, n_starts):
+    """best (ln K, ln Kc) of a logarithmic grid, evaluated in one pass"""
+    import numpy as np
+    positive = t[t > 0]
+    K = np.geomspace(1e-2*Ra**2/positive.max(), 1e1*Ra**2/positive.min(), n_grid[0])
+    # the last sample estimates the equilibrium, rho_inf = rho_c0 - D/(Kc + 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Kc_eq = (rho_c0 - rho_i)/(rho_c0 - rho[np.argmax(t)]) - 1
+    centre = Kc_eq if np.isfinite(Kc_eq) and Kc_eq > 0 else 1.0
+    Kc = centre*np.geomspace(1e-1, 1e1, n_grid[1])
+    # a coarse subset of samples and roots is enough to rank the starts
+    sample = np.unique(np.linspace(0, positive.size - 1, min(positive.size, 64)).astype(int))
+    model = cj_analytical_edge_concentration_grid(positive[sample], rho_c0, rho_i, Kc[None, :], K[:, None],
+                                                  Ra, min(n, 20))
+    rss = np.sum((model - rho[t > 0][sample])**2, axis=-1)
+    rss = np.where(np.isfinite(rss), rss, np.inf).ravel()
+    best = np.argsort(rss)[:n_starts]
+    i, j = np.unravel_index(best, (K.size, Kc.size))
+    return [np.log([K[a], Kc[b]]) for a, b in zip(i, j)]
+
+
+def fit_edge_concentration(t, rho, rho_c0, rho_i, Ra, n=99, n_grid=(24, 12), n_starts=4, processes=1):
+    """fit K and Kc of the Carslaw Jaeger solution to an edge concentration series
+
+    Arguments:
+        t {array_like} -- time in seconds
+        rho {array_like} -- measured gas concentration at edge mol/m^3
+        rho_c0 {float} -- initial concentration at edge mol/m^3
+        rho_i {float} -- initial concentration at centre mol/m^3
+        Ra {float} -- particle radius
+
+    Keyword Arguments:
+        n {int} -- number of roots of the series (default: {99})
+        n_grid {tuple} -- size of the (K, Kc) grid used for the multistart (default: {(24, 12)})
+        n_starts {int} -- number of grid points polished by least squares (default: {4})
+        processes {int} -- worker processes for the multistart, None uses every cpu (default: {1})
+
+    Returns:
+        numpy record -- params (K, Kc), std, cov, rss, nfev and success
+    """
+    import numpy as np
+    t = np.asarray(t, dtype=float).ravel()
+    rho = np.asarray(rho, dtype=float).ravel()
+    if not np.any(t > 0):
+        raise ValueError('at least one positive time is needed')
+    # the series is only evaluated where it converges
+    keep = t > 0
+    t, rho = t[keep], rho[keep]
+    tasks = [(start, t, rho, rho_c0, rho_i, Ra, n)
+             for start in _grid_starts(t, rho, rho_c0, rho_i, Ra, n, n_grid, n_starts)]
+    fits = map_fits(_polish, tasks, processes)
+
+    result = np.zeros((), dtype=[('params', float, (2,)), ('std', float, (2,)), ('cov', float, (2, 2)),
+                                 ('rss', float), ('nfev', int), ('success', bool)])
+    result['params'] = np.nan
+    result['rss'] = np.inf
+    for fit in fits:
+        result['nfev'] += fit.nfev
+        if fit.rss >= result['rss']:
+            continue
+        params = np.exp(fit.params)
+        # first order propagation from (ln K, ln Kc) to (K, Kc)
+        cov = fit.cov*np.outer(params, params)
+        result['params'], result['cov'], result['rss'], result['success'] = params, cov, fit.rss, fit.success
+        result['std'] = np.sqrt(np.diag(cov))
+    return result[()]
+
+
+def invert_pressure_decay(t, pressure, temperature, gas, rho_i, Ra, rho_c0=None, backend='coolprop', **kwargs):
+    """fit diffusivity and storage ratio to a measured edge pressure decay
+
+    Arguments:
+        t {array_like} -- time in seconds
+        pressure {array_like} -- measured edge pressure Pa_a
+        temperature {float} -- temperature K
+        gas {str} -- CoolProp fluid name
+        rho_i {float} -- initial concentration inside the particles mol/m^3
+        Ra {float} -- particle radius
+
+    Keyword Arguments:
+        rho_c0 {float} -- initial concentration at edge mol/m^3, the first sample if None (default: {None})
+        backend {str} -- get_rhom backend, 'coolprop', 'table' or 'state' (default: {'coolprop'})
+        **kwargs -- passed to fit_edge_concentration
+
+    Returns:
+        numpy record -- params (K, Kc), std, cov, rss, nfev and success
+    """
+    import numpy as np
+    from calculate_moles import get_rhom
+    t = np.asarray(t, dtype=float).ravel()
+    pressure = np.asarray(pressure, dtype=float).ravel()
+    rho = np.asarray(get_rhom(pressure, np.full(pressure.shape, float(temperature)), gas, backend), dtype=float)
+    if rho_c0 is None:
+        rho_c0 = rho[np.argmin(t)]
+    return fit_edge_concentration(t, rho, rho_c0, rho_i, Ra, **kwargs)
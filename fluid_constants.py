@@ -0,0 +1,57 @@
+"""
+process-wide registry of fluid constants
+
+Critical properties, acentric factor and normal boiling point are looked up
+in CoolProp once per gas and kept for the life of the process, together
+with the van der Waals constants used by calculate_moles.
+"""
+from collections import namedtuple
+from functools import lru_cache
+
+from lazy_imports import lazy_import
+
+CP = lazy_import('CoolProp.CoolProp')
+
+FluidConstants = namedtuple('FluidConstants', [
+    'critical_temperature',
+    'critical_pressure',
+    'acentric',
+    'normal_boiling_point',
+    'vanderwaals_a',
+    'vanderwaals_b'
+])
+
+# a Pa m^6/mol^2, b m^3/mol
+VANDERWAALS_CONSTANTS = {
+    'methane': [0.2283,4.278e-05],
+    'carbondioxide': [0.364,4.267e-05],
+    'helium':[0.00346,2.3800000000000003e-05]
+}
+
+
+@lru_cache(maxsize=None)
+def get_fluid_constants(gas):
+    """look up the constants of a gas, querying CoolProp only on the first call
+
+    Arguments:
+        gas {str} -- CoolProp fluid name
+
+    Returns:
+        FluidConstants -- critical temperature K, critical pressure Pa, acentric factor,
+        normal boiling point K (None if the gas does not boil at 1 atm) and
+        van der Waals a and b (None if not tabulated)
+    """
+    try:
+        normal_boiling_point = CP.PropsSI('T', 'P', 101325, 'Q', 0, gas)
+    except ValueError:
+        # e.g. carbon dioxide sublimes at atmospheric pressure
+        normal_boiling_point = None
+    a, b = VANDERWAALS_CONSTANTS.get(gas, (None, None))
+    return FluidConstants(
+        critical_temperature=CP.PropsSI('TCRIT', gas),
+        critical_pressure=CP.PropsSI('PCRIT', gas),
+        acentric=CP.PropsSI('ACENTRIC', gas),
+        normal_boiling_point=normal_boiling_point,
+        vanderwaals_a=a,
+        vanderwaals_b=b
+    )
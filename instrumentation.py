@@ -0,0 +1,132 @@
+"""
+opt-in instrumentation of property, solver and fitting calls
+
+Instrumented functions record call counts and wall time per function and
+per label (e.g. gas and EOS), and solvers add iteration counts and cache
+hits. It is off by default, when an instrumented call costs one flag check;
+switch it on with enable() or the PYTHON_SCRIPTS_INSTRUMENT environment
+variable, then read it with summary() or export_chrome_trace() and load the
+trace in chrome://tracing or Perfetto. Calls made in worker processes are
+recorded in those processes only.
+"""
+import functools
+import json
+import os
+import threading
+import time
+
+ENABLED = bool(os.environ.get('PYTHON_SCRIPTS_INSTRUMENT'))
+MAX_EVENTS = 10**6
+
+_lock = threading.Lock()
+_stats = {}
+_events = []
+_origin = time.perf_counter()
+
+
+def enable():
+    global ENABLED
+    ENABLED = True
+
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+
+def reset():
+    """forget every recorded call and trace event"""
+    global _origin
+    with _lock:
+        _stats.clear()
+        del _events[:]
+        _origin = time.perf_counter()
+
+
+def _entry(name, label):
+    key = (name, label)
+    entry = _stats.get(key)
+    if entry is None:
+        entry = _stats[key] = {'calls': 0, 'seconds': 0.0, 'iterations': 0, 'hits': 0, 'misses': 0}
+    return entry
+
+
+def instrument(name=None, label=None):
+    """decorator recording calls and wall time of a function
+
+    Keyword Arguments:
+        name {str} -- name in the report, module.function if None (default: {None})
+        label {callable} -- called with the function's arguments, returns a label
+            such as the gas, so the report is split per label (default: {None})
+    """
+    def decorate(function):
+        report_name = name or '{}.{}'.format(function.__module__, function.__qualname__)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            tag = label(*args, **kwargs) if label is not None else None
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stop = time.perf_counter()
+                with _lock:
+                    entry = _entry(report_name, tag)
+                    entry['calls'] += 1
+                    entry['seconds'] += stop - start
+                    if len(_events) < MAX_EVENTS:
+                        _events.append((report_name, tag, start, stop, threading.get_ident()))
+        return wrapper
+    return decorate
+
+
+def record_iterations(name, iterations, label=None):
+    """add solver iterations to a function's entry"""
+    if not ENABLED:
+        return
+    with _lock:
+        _entry(name, label)['iterations'] += int(iterations)
+
+
+def record_cache(name, hit, label=None):
+    """count a cache hit or miss for a function's entry"""
+    if not ENABLED:
+        return
+    with _lock:
+        _entry(name, label)['hits' if hit else 'misses'] += 1
+
+
+def statistics():
+    """copy of the recorded statistics, keyed by (name, label)"""
+    with _lock:
+        return {key: dict(entry) for key, entry in _stats.items()}
+
+
+def summary(sort='seconds'):
+    """table of calls, total and mean time, iterations and cache hit rate, slowest first"""
+    rows = sorted(statistics().items(), key=lambda item: -item[1][sort])
+    header = '{:<64} {:>9} {:>11} {:>11} {:>11} {:>8}'.format('function [label]', 'calls', 'total s',
+                                                             'mean s', 'iterations', 'hit rate')
+    lines = [header, '-'*len(header)]
+    for (name, label), entry in rows:
+        title = name if label is None else '{} [{}]'.format(name, label)
+        lookups = entry['hits'] + entry['misses']
+        lines.append('{:<64} {:>9d} {:>11.4g} {:>11.4g} {:>11d} {:>8}'.format(
+            title, entry['calls'], entry['seconds'], entry['seconds']/entry['calls'] if entry['calls'] else 0,
+            entry['iterations'], '{:.1%}'.format(entry['hits']/lookups) if lookups else '-'))
+    return '\n'.join(lines)
+
+
+def export_chrome_trace(path):
+    """write the recorded calls as chrome trace event json"""
+    with _lock:
+        events = list(_events)
+        origin = _origin
+    trace = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': os.getpid(), 'tid': thread,
+              'ts': (start - origin)*1e6, 'dur': (stop - start)*1e6,
+              'args': {} if label is None else {'label': str(label)}}
+             for name, label, start, stop, thread in events]
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
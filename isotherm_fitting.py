@@ -0,0 +1,241 @@
+"""
+batch fitting of the isotherm_models with analytic jacobians
+
+Every model carries its analytic jacobian, a linearised starting guess and
+bounds, and is fitted with scipy.optimize.least_squares. fit_isotherms fits
+many datasets at once across a process pool and returns a structured array
+with the parameters, residual sum of squares, covariance and AIC of each.
+fit_langmuir_temperatures fits isotherms measured at several temperatures
+at once, with qm = a1 + a2/T and b = 1/PL, PL = P0*exp(Q/(R*T)).
+"""
+from collections import namedtuple
+
+import instrumentation
+
+from isotherm_models import (linear, langmuir, freundlich, dubinin_radushkevich,
+                             langmuir_volume_temperature, langmuir_pressure_temperature)
+from least_squares_fitting import least_squares_with_stats, map_fits
+
+IsothermModel = namedtuple('IsothermModel', ['function', 'jacobian', 'initial_guess', 'parameters', 'lower', 'fixed'])
+
+
+def _linear_jacobian(cg, K):
+    import numpy as np
+    return np.asarray(cg, dtype=float)[:, None]
+
+def _linear_guess(cg, q):
+    import numpy as np
+    return [np.dot(cg, q)/np.dot(cg, cg)]
+
+
+def _langmuir_jacobian(cg, qm, b):
+    import numpy as np
+    denominator = 1 + b*cg
+    return np.column_stack([b*cg/denominator, qm*cg/denominator**2])
+
+def _langmuir_guess(cg, q):
+    import numpy as np
+    # cg/q = 1/(qm*b) + cg/qm
+    keep = q > 0
+    slope, intercept = np.polyfit(cg[keep], cg[keep]/q[keep], 1)
+    if slope <= 0 or intercept <= 0:
+        return [2*np.max(q), 1/np.median(cg)]
+    return [1/slope, slope/intercept]
+
+
+def _freundlich(P, K, n):
+    import numpy as np
+    # q and its derivatives go to 0 as P goes to 0
+    positive = P > 0
+    return np.where(positive, freundlich(np.where(positive, P, 1), K, n), 0)
+
+def _freundlich_jacobian(P, K, n):
+    import numpy as np
+    positive = P > 0
+    P = np.where(positive, P, 1)
+    power = np.where(positive, P**(1/n), 0)
+    return np.column_stack([power, -K*power*np.log(P)/n**2])
+
+def _freundlich_guess(P, q):
+    import numpy as np
+    # ln(q) = ln(K) + ln(P)/n
+    keep = (P > 0) & (q > 0)
+    slope, intercept = np.polyfit(np.log(P[keep]), np.log(q[keep]), 1)
+    return [np.exp(intercept), 1/slope if slope > 0 else 1.0]
+
+
+def _dubinin_radushkevich(P, V0, E, T, P0):
+    import numpy as np
+    # q and its derivatives go to 0 as P goes to 0
+    positive = P > 0
+    return np.where(positive, dubinin_radushkevich(np.where(positive, P, P0), T, P0, V0, E), 0)
+
+def _dubinin_radushkevich_jacobian(P, V0, E, T, P0):
+    import numpy as np
+    positive = P > 0
+    x2 = ((8.314*T/E)*np.log(P0/np.where(positive, P, P0)))**2
+    f = np.where(positive, np.exp(-x2), 0)
+    return np.column_stack([f, V0*f*2*x2/E])
+
+def _dubinin_radushkevich_guess(P, q, T, P0):
+    import numpy as np
+    # ln(q) = ln(V0) - (8.314*T*ln(P0/P))^2/E^2
+    keep = (P > 0) & (q > 0)
+    A2 = (8.314*T*np.log(P0/np.where(keep, P, P0)))**2
+    slope, intercept = np.polyfit(A2[keep], np.log(q[keep]), 1)
+    return [np.exp(intercept), (-1/slope)**0.5 if slope < 0 else np.sqrt(np.mean(A2))]
+
+
+MODELS = {
+    'linear': IsothermModel(linear, _linear_jacobian, _linear_guess, ('K',), (-float('inf'),), ()),
+    'langmuir': IsothermModel(langmuir, _langmuir_jacobian, _langmuir_guess, ('qm', 'b'), (0, 0), ()),
+    'freundlich': IsothermModel(_freundlich, _freundlich_jacobian, _freundlich_guess, ('K', 'n'), (0, 0), ()),
+    'dubinin_radushkevich': IsothermModel(_dubinin_radushkevich, _dubinin_radushkevich_jacobian,
+                                          _dubinin_radushkevich_guess, ('V0', 'E'), (0, 0), ('T', 'P0')),
+}
+
+
+def result_dtype(model):
+    """dtype of the structured array returned by fit_isotherms"""
+    p = len(MODELS[model].parameters)
+    return [('params', float, (p,)), ('rss', float), ('cov', float, (p, p)),
+            ('aic', float), ('nfev', int), ('success', bool)]
+
+
+@instrumentation.instrument(label=lambda task: task[0])
+def _fit_one(task):
+    import numpy as np
+    model, P, q, fixed = task
+    m = MODELS[model]
+    P = np.asarray(P, dtype=float).ravel()
+    q = np.asarray(q, dtype=float).ravel()
+    extra = tuple(fixed[name] for name in m.fixed)
+    lower = np.array(m.lower, dtype=float)
+
+    try:
+        guess = np.asarray(m.initial_guess(P, q, *extra), dtype=float)
+        # least_squares needs a strictly feasible start
+        guess = np.where(np.isfinite(guess) & (guess > lower), guess, np.where(np.isfinite(lower), lower + 1e-6, 1.0))
+        fit = least_squares_with_stats(lambda x: (m.function(P, *x, *extra) - q, m.jacobian(P, *x, *extra)),
+                                       guess, bounds=(lower, np.inf))
+    except (ValueError, TypeError, np.linalg.LinAlgError):
+        # a dataset that cannot be fitted is reported, not allowed to abort the batch
+        p = len(m.parameters)
+        return np.full(p, np.nan), np.nan, np.full((p, p), np.nan), np.nan, 0, False
+    instrumentation.record_iterations('isotherm_fitting._fit_one', fit.nfev, model)
+    return fit.params, fit.rss, fit.cov, fit.aic, fit.nfev, fit.success
+
+
+def fit_isotherms(model, datasets, processes=None, chunksize=None):
+    """fit one isotherm model to many datasets
+
+    Arguments:
+        model {str} -- linear, langmuir, freundlich or dubinin_radushkevich
+        datasets {iterable} -- (P, q) pairs, or (P, q, fixed) where fixed is a dict
+            of the model's fixed arguments, e.g. {'T': 318, 'P0': 7.4e6} for dubinin_radushkevich
+
+    Keyword Arguments:
+        processes {int} -- worker processes, 1 fits serially, None uses every cpu (default: {None})
+        chunksize {int} -- datasets sent to a worker at a time, None splits the
+            datasets into four chunks per worker (default: {None})
+
+    Returns:
+        numpy structured array -- params, rss, cov, aic, nfev and success for every dataset
+    """
+    import numpy as np
+    if model not in MODELS:
+        raise ValueError('invalid isotherm model {}'.format(model))
+    tasks = [(model, d[0], d[1], d[2] if len(d) > 2 else {}) for d in datasets]
+    fits = map_fits(_fit_one, tasks, processes, chunksize)
+    result = np.empty(len(fits), dtype=result_dtype(model))
+    for row, fit in zip(result, fits):
+        row['params'], row['rss'], row['cov'], row['aic'], row['nfev'], row['success'] = fit
+    return result
+
+
+def fit_isotherm(model, P, q, **fixed):
+    """fit one isotherm model to one dataset
+
+    Arguments:
+        model {str} -- linear, langmuir, freundlich or dubinin_radushkevich
+        P {array_like} -- pressure or gas concentration
+        q {array_like} -- amount adsorbed
+        **fixed -- fixed model arguments, T and P0 for dubinin_radushkevich
+
+    Returns:
+        numpy record -- params, rss, cov, aic, nfev and success
+    """
+    return fit_isotherms(model, [(P, q, fixed)], processes=1)[0]
+
+
+TEMPERATURE_LANGMUIR_PARAMETERS = ('a1', 'a2', 'P0', 'Q')
+
+
+def _temperature_langmuir(x, T, P):
+    """stacked langmuir isotherm and jacobian with respect to (a1, a2, ln(P0), Q)"""
+    import numpy as np
+    a1, a2, log_P0, Q = x
+    qm = langmuir_volume_temperature(T, a1, a2)
+    PL = langmuir_pressure_temperature(T, np.exp(log_P0), Q)
+    coverage = P/(PL + P)
+    q = langmuir(P, qm, 1/PL)
+    d_log_PL = -q*PL/(PL + P)
+    return q, np.column_stack([coverage, coverage/T, d_log_PL, d_log_PL/(8.314*T)])
+
+
+def _temperature_langmuir_guess(T, P, q):
+    """per temperature linearised langmuir fits regressed against 1/T"""
+    import numpy as np
+    temperatures = np.unique(T)
+    qm = np.empty(temperatures.size)
+    log_PL = np.empty(temperatures.size)
+    for i, temperature in enumerate(temperatures):
+        at = T == temperature
+        qm[i], b = _langmuir_guess(P[at], q[at])
+        log_PL[i] = -np.log(b)
+    if temperatures.size == 1:
+        return [qm[0], 0.0, log_PL[0], 0.0]
+    a2, a1 = np.polyfit(1/temperatures, qm, 1)
+    slope, log_P0 = np.polyfit(1/temperatures, log_PL, 1)
+    return [a1, a2, log_P0, 8.314*slope]
+
+
+def fit_langmuir_temperatures(datasets):
+    """fit one langmuir isotherm with temperature dependent parameters to isotherms at several temperatures
+
+    All points are stacked into one residual, so a1, a2, P0 and Q are
+    shared by every temperature and found in a single least squares call.
+
+    Arguments:
+        datasets {iterable} -- (T, P, q) triples, one per isotherm, T a float and P, q arrays
+
+    Returns:
+        numpy record -- params (a1, a2, P0, Q), rss, cov, aic, nfev and success
+    """
+    import numpy as np
+    T, P, q = [], [], []
+    for temperature, pressure, amount in datasets:
+        pressure = np.asarray(pressure, dtype=float).ravel()
+        T.append(np.full(pressure.size, float(temperature)))
+        P.append(pressure)
+        q.append(np.asarray(amount, dtype=float).ravel())
+    T, P, q = np.concatenate(T), np.concatenate(P), np.concatenate(q)
+
+    def residual_and_jacobian(x):
+        model, jacobian = _temperature_langmuir(x, T, P)
+        return model - q, jacobian
+
+    guess = np.asarray(_temperature_langmuir_guess(T, P, q), dtype=float)
+    guess = np.where(np.isfinite(guess), guess, [2*np.max(q), 0.0, np.log(np.median(P)), 0.0])
+    fit = least_squares_with_stats(residual_and_jacobian, guess)
+    n_params = guess.size
+    params = fit.params.copy()
+    params[2] = np.exp(params[2])
+    # first order propagation from ln(P0) to P0
+    scale = np.array([1, 1, params[2], 1])
+    cov = fit.cov*np.outer(scale, scale)
+    result = np.empty((), dtype=[('params', float, (n_params,)), ('rss', float), ('cov', float, (n_params, n_params)),
+                                 ('aic', float), ('nfev', int), ('success', bool)])
+    result['params'], result['rss'], result['cov'], result['aic'], result['nfev'], result['success'] = \
+        params, fit.rss, cov, fit.aic, fit.nfev, fit.success
+    return result[()]
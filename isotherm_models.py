@@ -25,7 +25,15 @@ def langmuir_volume_temperature(T,a1,a2):
     return a1 + a2/T
 
 def langmuir_pressure_temperature(T,P0,Q):
-    """ to be completed 
+    """calculates the langmuir pressure at different temperatures PL = P0*exp(Q/(R*T)), b = 1/PL
+    
+    Arguments:
+        T {float} -- Temperature K
+        P0 {float} -- langmuir pressure at infinite temperature, same units as cg
+        Q {float} -- energy parameter J/mol
+    
+    Returns:
+        float -- langmuir pressure
     """
     from numpy import exp
     return P0*exp(Q/(8.314*T))
@@ -0,0 +1,163 @@
+"""
+batch fitting and model selection for the kinetic_models
+
+Every kinetic model is linear in two of its parameters once a single rate
+s is fixed, q = c0*h0(t, s) + c1*h1(t, s):
+
+    firstorder   h0 = exp(-s*t)          h1 = 1 - exp(-s*t)      (q0, qe, k1 = s)
+    secondorder  h0 = 1 - s*t/(1 + s*t)  h1 = s*t/(1 + s*t)      (q0, qe, k2 = s/|qe - q0|)
+    elovich      h0 = 1                  h1 = ln(1 + s*t)        (q0, a = s*c1, b = 1/c1)
+
+so the multistart is a vectorized scan over a grid of rates, with the two
+linear coefficients solved in closed form for every rate at once. The best
+starts are then polished with scipy.optimize.least_squares using analytic
+jacobians, and the models are ranked per curve by AIC or BIC. fit_kinetics
+fits many curves across a process pool with least_squares_fitting.map_fits.
+"""
+import instrumentation
+
+from least_squares_fitting import least_squares_with_stats, map_fits
+
+MODELS = ('firstorder', 'secondorder', 'elovich')
+
+
+def _basis(model, t, s):
+    """h0, h1 and their derivatives with respect to s, for rates s broadcast against t"""
+    import numpy as np
+    st = s*t
+    if model == 'firstorder':
+        E = np.exp(-st)
+        return E, 1 - E, -t*E, t*E
+    if model == 'secondorder':
+        g = st/(1 + st)
+        dg = t/(1 + st)**2
+        return 1 - g, g, -dg, dg
+    if model == 'elovich':
+        return np.ones_like(st), np.log1p(st), np.zeros_like(st), t/(1 + st)
+    raise ValueError('invalid kinetic model {}'.format(model))
+
+
+def _native_parameters(model, x):
+    """convert the fitted (c0, c1, s) to the arguments of the kinetic_models function"""
+    c0, c1, s = x
+    if model == 'firstorder':
+        return c0, c1, s
+    if model == 'secondorder':
+        return c0, c1, s/abs(c1 - c0)
+    return c0, s*c1, 1/c1
+
+
+def _grid_starts(model, t, q, rates, n_starts):
+    """closed form linear coefficients for every rate on the grid, best n_starts kept"""
+    import numpy as np
+    h0, h1, _, _ = _basis(model, t[None, :], rates[:, None])
+    # normal equations of the 2 parameter linear least squares, one per rate
+    a00 = np.einsum('st,st->s', h0, h0)
+    a01 = np.einsum('st,st->s', h0, h1)
+    a11 = np.einsum('st,st->s', h1, h1)
+    b0 = h0 @ q
+    b1 = h1 @ q
+    determinant = a00*a11 - a01**2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        c0 = (a11*b0 - a01*b1)/determinant
+        c1 = (a00*b1 - a01*b0)/determinant
+        residual = q[None, :] - c0[:, None]*h0 - c1[:, None]*h1
+        rss = np.einsum('st,st->s', residual, residual)
+    rss = np.where(np.isfinite(rss), rss, np.inf)
+    best = np.argsort(rss)[:n_starts]
+    return [np.array([c0[i], c1[i], rates[i]]) for i in best if np.isfinite(rss[i])]
+
+
+def _polish(model, t, q, start):
+    import numpy as np
+
+    def residual_and_jacobian(x):
+        # one evaluation of the basis (and of exp(-k*t)) for both
+        h0, h1, dh0, dh1 = _basis(model, t, x[2])
+        return x[0]*h0 + x[1]*h1 - q, np.column_stack([h0, h1, x[0]*dh0 + x[1]*dh1])
+
+    return least_squares_with_stats(residual_and_jacobian, start, bounds=([-np.inf, -np.inf, 0], np.inf))
+
+
+@instrumentation.instrument(label=lambda model, *args, **kwargs: model)
+def fit_kinetic_model(model, t, q, n_rates=64, n_starts=3):
+    """fit one kinetic model to one uptake curve
+
+    Arguments:
+        model {str} -- firstorder, secondorder or elovich
+        t {array_like} -- time
+        q {array_like} -- amount adsorbed
+
+    Keyword Arguments:
+        n_rates {int} -- size of the logarithmic rate grid used for the multistart (default: {64})
+        n_starts {int} -- number of grid points polished by least squares (default: {3})
+
+    Returns:
+        tuple -- (params of the kinetic_models function, rss, nfev, success)
+    """
+    import numpy as np
+    t = np.asarray(t, dtype=float).ravel()
+    q = np.asarray(q, dtype=float).ravel()
+    positive = t[t > 0]
+    span = (positive.min(), t.max()) if positive.size else (1.0, 1.0)
+    rates = np.geomspace(1e-2/span[1], 1e2/span[0], n_rates)
+
+    best = None
+    nfev = 0
+    for start in _grid_starts(model, t, q, rates, n_starts):
+        fit = _polish(model, t, q, start)
+        nfev += fit.nfev
+        if best is None or fit.rss < best.rss:
+            best = fit
+    instrumentation.record_iterations('kinetic_fitting.fit_kinetic_model', nfev, model)
+    if best is None:
+        return (np.nan,)*3, np.inf, nfev, False
+    return _native_parameters(model, best.params), best.rss, nfev, best.success
+
+
+def _fit_curve(task):
+    """rows of fit_kinetics for one curve"""
+    import numpy as np
+    i, t, q, models, kwargs = task
+    m = np.size(q)
+    rows = []
+    for model in models:
+        params, rss, nfev, success = fit_kinetic_model(model, t, q, **kwargs)
+        with np.errstate(divide='ignore'):
+            log_likelihood = m*np.log(rss/m)
+        rows.append((i, model, params, rss, log_likelihood + 2*3, log_likelihood + 3*np.log(m),
+                     nfev, success, 0))
+    return rows
+
+
+def fit_kinetics(curves, models=MODELS, criterion='aic', processes=None, chunksize=None, **kwargs):
+    """fit every kinetic model to many uptake curves and rank the models per curve
+
+    Arguments:
+        curves {iterable} -- (t, q) pairs
+
+    Keyword Arguments:
+        models {tuple} -- models to fit (default: {('firstorder', 'secondorder', 'elovich')})
+        criterion {str} -- 'aic' or 'bic' used for the rank field (default: {'aic'})
+        processes {int} -- worker processes, 1 fits serially, None uses every cpu (default: {None})
+        chunksize {int} -- curves sent to a worker at a time, None splits the
+            curves into four chunks per worker (default: {None})
+        **kwargs -- passed to fit_kinetic_model
+
+    Returns:
+        numpy structured array -- one row per (curve, model) with fields curve, model,
+        params, rss, aic, bic, nfev, success and rank (0 is the preferred model of the curve)
+    """
+    import numpy as np
+    if criterion not in ('aic', 'bic'):
+        raise ValueError('invalid criterion {}'.format(criterion))
+    dtype = [('curve', int), ('model', 'U16'), ('params', float, (3,)), ('rss', float),
+             ('aic', float), ('bic', float), ('nfev', int), ('success', bool), ('rank', int)]
+    tasks = [(i, t, q, tuple(models), kwargs) for i, (t, q) in enumerate(curves)]
+    fits = map_fits(_fit_curve, tasks, processes, chunksize)
+    rows = [row for fit in fits for row in fit]
+    result = np.array(rows, dtype=dtype)
+    for i in np.unique(result['curve']):
+        rows = np.nonzero(result['curve'] == i)[0]
+        result['rank'][rows[np.argsort(result[criterion][rows], kind='stable')]] = np.arange(rows.size)
+    return result
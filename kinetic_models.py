@@ -1,3 +1,8 @@
+from functools import lru_cache
+
+import instrumentation
+
+
 def firstorder(t, q0, qe, k1):
     """
     first order fitting function
@@ -21,49 +26,115 @@ def secondorder(t, q0, qe, k2):
     """
     return (qe * k2 * t * abs(qe - q0) + q0)/(1 + k2 * t * abs(qe - q0))
 
-def elovich(t, q0, qe, k2):
+def elovich(t, q0, a, b):
     """
-    second order fitting function
+    elovich fitting function q = q0 + ln(1 + a*b*t)/b
     :param t: time
     :param q0: initial adsorbed at time t = 0
-    :param qe: equilibrium adsorbed at time t = infinity
-    :param k2: second order fitting parameter
+    :param a: initial adsorption rate
+    :param b: desorption constant
     :return: amount adsorbed at time t
     """
-    return 1#(-log(exp))
+    import numpy as np
+    return q0 + np.log(1 + a * b * t) / b
+
+def root_function(alpha, Kc):
+    """eigenvalue equation for radial diffusion with a finite reservoir
+    f(alpha) = 3*sin(alpha) + Kc*alpha^2*sin(alpha) - 3*alpha*cos(alpha)
+    """
+    import numpy as np
+    return 3*np.sin(alpha) + Kc*(alpha**2)*np.sin(alpha) - 3*alpha*np.cos(alpha)
+
+def root_function_derivative(alpha, Kc):
+    """derivative of root_function with respect to alpha"""
+    import numpy as np
+    return alpha*((2*Kc + 3)*np.sin(alpha) + Kc*alpha*np.cos(alpha))
 
+def polish_roots(lo, hi, Kc, tol=1e-15, max_iter=100):
+    """polish bracketed roots to machine precision with a safeguarded newton step
+    
+    Arguments:
+        lo {numpy array} -- lower end of each bracket
+        hi {numpy array} -- upper end of each bracket
+        Kc {float} -- ratio of gas storage capacity
+    
+    Returns:
+        numpy array -- polished roots
+    """
+    import numpy as np
+    f_lo = root_function(lo, Kc)
+    f_hi = root_function(hi, Kc)
+    # start from the linear interpolation used by the original scan
+    x = lo - f_lo*((hi - lo)/(f_hi - f_lo))
+    for _ in range(max_iter):
+        fx = root_function(x, Kc)
+        # shrink the brackets so every newton step stays safeguarded
+        same_side = np.sign(fx) == np.sign(f_lo)
+        lo = np.where(same_side, x, lo)
+        f_lo = np.where(same_side, fx, f_lo)
+        hi = np.where(same_side, hi, x)
+        dfx = root_function_derivative(x, Kc)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            x_new = x - fx/dfx
+        outside = ~((x_new >= lo) & (x_new <= hi))
+        x_new = np.where(outside, 0.5*(lo + hi), x_new)
+        x_new = np.where(fx == 0, x, x_new)
+        converged = np.abs(x_new - x) <= tol*np.abs(x_new)
+        x = x_new
+        if np.all(converged):
+            break
+    return x
+
+@lru_cache(maxsize=256)
+def _cached_analytical_roots(Kc, n):
+    import numpy as np
+    alpha_set = np.linspace(0,100*np.pi,50000)
+    # every non-trivial root lies in (j*pi, (j+1/2)*pi) so only scan as far as needed
+    stop = min(np.searchsorted(alpha_set, (n + 2)*np.pi) + 1, alpha_set.size)
+    while True:
+        alpha = alpha_set[:stop]
+        y = root_function(alpha, Kc)
+        brackets = np.nonzero(y[:-1]*y[1:] < 0)[0][:n]
+        if brackets.size >= n or stop == alpha_set.size:
+            break
+        stop = alpha_set.size
+    roots = polish_roots(alpha[brackets], alpha[brackets + 1], Kc)
+    roots.setflags(write=False)
+    return roots
+
+@instrumentation.instrument()
 def _get_analytical_roots(Kc,n):
     """calculate roots for the analytical equation ...
     for radial diffusion based on carlslaw jaeger
     
+    Sign changes are bracketed in one vectorized pass over the original
+    search grid, polished to machine precision and memoized on (Kc, n).
+    
     Arguments:
         Kc {float} -- Kc - ratio of gas storage capacity 
         n {float} -- number of roots
     
     Returns:
-        numpy list -- list of roots
+        numpy array -- read-only array of roots
     """
-    import numpy as np
-    y0 = 0
-    y1 = 0
-    a0 = 0
-    roots = []
-    alpha_set = np.linspace(0,100*np.pi,50000)
-    for a1 in alpha_set:
-        y1 = 3*np.sin(a1) + Kc*(a1**2)*np.sin(a1) - 3*a1*np.cos(a1)
-        if abs(y0+y1) != (abs(y0)+abs(y1)):
-            af = a0 - y0*((a1-a0)/(y1-y0))
-            roots.append(af)
-            if len(roots)>=n:
-                break
-        a0 = a1
-        y0 = y1
+    if not instrumentation.ENABLED:
+        return _cached_analytical_roots(float(Kc), int(n))
+    hits = _cached_analytical_roots.cache_info().hits
+    roots = _cached_analytical_roots(float(Kc), int(n))
+    instrumentation.record_cache('kinetic_models._get_analytical_roots', _cached_analytical_roots.cache_info().hits > hits)
     return roots
 
-def cj_analytical_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra,n):
+def cj_analytical_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra,n,tol=None,method='series'):
     """get analytical solution for gas concentration based ...
     on radial diffusion function (Carlslaw Jaeger)
     
+    With tol the error is controlled instead: every time point uses only as
+    many of the n roots as its truncation bound needs, and short times, where
+    the series converges slowly, use the erfc-type short time expansion.
+    
+    method 'talbot' or 'stehfest' skips the eigenvalues altogether and
+    numerically inverts the closed form laplace solution (see laplace_diffusion).
+    
     Arguments:
         t {int} -- time in seconds
         rho_c0 {float} -- initial concentration at edge mol/m^3
@@ -71,15 +142,185 @@ def cj_analytical_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra,n):
         Kc {float} -- gas storage capacity 
         K {float} -- gas diffusion coefficient
         Ra {float} -- particle radius
-        n {int} -- number of roots
+        n {int} -- number of roots, the maximum number of terms if tol is given
+    
+    Keyword Arguments:
+        tol {float} -- error relative to (rho_c0 - rho_i) (default: {None})
+        method {str} -- series, talbot or stehfest (default: {'series'})
     
     Returns:
         float -- gas concentration at edge
     """
     import numpy as np
-    sum_roots = 0
+    if method != 'series':
+        from laplace_diffusion import laplace_edge_concentration
+        return laplace_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra,'sphere',method)
+    if tol is not None:
+        return _cj_adaptive_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra,n,tol)
     roots = _get_analytical_roots(Kc,n)
-    for alpha in roots:
-        sum_roots += np.exp(-(K*(alpha**2)*t)/((Ra)**2))/(((Kc**2)*(alpha**2))+9*(Kc+1))
+    weights = 1/(((Kc**2)*(roots**2))+9*(Kc+1))
+    decay = (K*(roots**2))/((Ra)**2)
+    sum_roots = np.exp(-decay*np.asarray(t)[...,np.newaxis]) @ weights
     rho =rho_c0-(rho_c0-rho_i)/(Kc+1)+(6*Kc)*(rho_c0-rho_i)*sum_roots
-    return rho
\ No newline at end of file
+    return rho
+
+def _cj_truncation_bound(N, tau, Kc):
+    """bound on sum_{j>N} exp(-alpha_j^2*tau)/(Kc^2*alpha_j^2 + 9*(Kc+1))
+    
+    The j-th root lies in (j*pi, (j+1/2)*pi), so the tail is bounded by the
+    integral of the summand from N with alpha = pi*x.
+    """
+    import numpy as np
+    from scipy.special import erfc
+    with np.errstate(divide='ignore', invalid='ignore'):
+        gaussian = np.where(tau > 0,
+                            erfc(N*np.pi*np.sqrt(tau))/(2*np.sqrt(np.pi*tau)),
+                            np.inf)/((Kc*np.pi*N)**2 + 9*(Kc+1))
+        algebraic = np.where(Kc > 0, 1/((Kc*np.pi)**2*N), np.inf)
+    return np.minimum(gaussian, algebraic)
+
+def cj_short_time_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra):
+    """short time expansion of the Carslaw Jaeger edge concentration
+    
+    Inverts the Laplace transform with coth(x) replaced by 1, which is exact
+    up to terms of order exp(-Ra^2/(K*t)).
+    
+    Arguments:
+        t {numpy array} -- time in seconds
+        rho_c0 {float} -- initial concentration at edge mol/m^3
+        rho_i {float} --  initial concentration at centre mol/m^3
+        Kc {float} -- gas storage capacity 
+        K {float} -- gas diffusion coefficient
+        Ra {float} -- particle radius
+    
+    Returns:
+        numpy array -- gas concentration at edge
+    """
+    import numpy as np
+    from scipy.special import erfcx
+    # U(s) = (rho_c0 - rho_i)/(s + gamma*sqrt(s) - beta) = (rho_c0 - rho_i)/((sqrt(s) - p1)*(sqrt(s) - p2))
+    gamma = 3*np.sqrt(K)/(Kc*Ra)
+    beta = 3*K/(Kc*Ra**2)
+    root = np.sqrt(gamma**2 + 4*beta)
+    p1 = (-gamma + root)/2
+    p2 = (-gamma - root)/2
+    sqrt_t = np.sqrt(np.asarray(t, dtype=float))
+    U = (p1*erfcx(-p1*sqrt_t) - p2*erfcx(-p2*sqrt_t))/(p1 - p2)
+    return rho_i + (rho_c0-rho_i)*U
+
+@lru_cache(maxsize=256)
+def _cj_truncation_times(Kc, n, tol):
+    """smallest tau at which N = 1..n terms meet tol, found by bisection on ln(tau)
+
+    The truncation bound falls with tau, so the N-term series is accurate
+    enough for every tau above the N-th threshold; 0 if it always is, inf if
+    it never is. The thresholds do not increase with N.
+    """
+    import numpy as np
+    N = np.arange(1, n + 1)
+
+    def meets(log_tau):
+        return 6*Kc*_cj_truncation_bound(N, np.exp(log_tau), Kc) <= tol
+
+    lo = np.full(n, np.log(1e-6))
+    hi = np.full(n, np.log(1e3))
+    low_meets, high_meets = meets(lo), meets(hi)
+    for _ in range(40):
+        mid = 0.5*(lo + hi)
+        below = meets(mid)
+        hi = np.where(below, mid, hi)
+        lo = np.where(below, lo, mid)
+    times = np.where(low_meets, 0, np.where(high_meets, np.exp(hi), np.inf))
+    times = np.minimum.accumulate(times)
+    times.setflags(write=False)
+    return times
+
+def _cj_adaptive_edge_concentration(t,rho_c0,rho_i,Kc,K,Ra,n,tol):
+    import numpy as np
+    if not 0 < tol < 1:
+        raise ValueError('tol must be between 0 and 1, got {}'.format(tol))
+    t = np.asarray(t, dtype=float)
+    tau = np.maximum(K*t.ravel()/Ra**2, 0)
+    rho = np.empty(tau.shape)
+
+    # the short time expansion is accurate to about exp(-1/tau)
+    short = (tau <= 1/np.log(1/tol)) if Kc > 0 else np.zeros(tau.shape, dtype=bool)
+    if short.any():
+        rho[short] = cj_short_time_edge_concentration(t.ravel()[short],rho_c0,rho_i,Kc,K,Ra)
+
+    series = ~short
+    if series.any():
+        equilibrium = rho_c0-(rho_c0-rho_i)/(Kc+1)
+        if Kc == 0:
+            # no reservoir, the series is multiplied by Kc and vanishes
+            rho[series] = equilibrium
+        else:
+            roots = _get_analytical_roots(Kc,n)
+            times = _cj_truncation_times(float(Kc), roots.size, float(tol))
+            tau_series = tau[series]
+            # tau only has to pass the thresholds of the first terms - 1 counts, the rest are already met
+            terms = np.minimum(np.searchsorted(-times, -tau_series, side='left') + 1, roots.size)
+            weights = 1/(((Kc**2)*(roots**2))+9*(Kc+1))
+            sum_roots = np.empty(tau_series.shape)
+            # points sharing a term count are evaluated together with only those roots
+            order = np.argsort(terms, kind='stable')
+            for group in np.split(order, np.flatnonzero(np.diff(terms[order])) + 1):
+                k = terms[group[0]]
+                sum_roots[group] = np.exp(-tau_series[group,None]*roots[None,:k]**2) @ weights[:k]
+            rho[series] = equilibrium+(6*Kc)*(rho_c0-rho_i)*sum_roots
+    if t.ndim == 0:
+        return rho[0]
+    return rho.reshape(t.shape)
+
+def cj_analytical_edge_concentration_grid(t,rho_c0,rho_i,Kc,K,Ra,n,max_elements=2**22):
+    """get analytical edge concentrations for a whole grid of parameters
+    
+    The parameters are broadcast against each other and the series is
+    evaluated as one (parameters x roots x time) contraction, processed in
+    chunks of parameter sets so that no intermediate exceeds max_elements.
+    
+    Arguments:
+        t {numpy array} -- time in seconds
+        rho_c0 {array_like} -- initial concentration at edge mol/m^3
+        rho_i {array_like} --  initial concentration at centre mol/m^3
+        Kc {array_like} -- gas storage capacity 
+        K {array_like} -- gas diffusion coefficient
+        Ra {array_like} -- particle radius
+        n {int} -- number of roots
+    
+    Keyword Arguments:
+        max_elements {int} -- largest intermediate array per chunk (default: {2**22})
+    
+    Returns:
+        numpy array -- gas concentration at edge, shape (broadcast parameter shape) + t.shape
+    """
+    import numpy as np
+    t = np.asarray(t, dtype=float)
+    rho_c0, rho_i, Kc, K, Ra = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in (rho_c0, rho_i, Kc, K, Ra)))
+    shape = Kc.shape
+    rho_c0, rho_i, Kc, K, Ra = (p.ravel() for p in (rho_c0, rho_i, Kc, K, Ra))
+    t_flat = t.ravel()
+
+    # roots only depend on Kc, so look them up once per distinct value
+    unique_Kc, inverse = np.unique(Kc, return_inverse=True)
+    roots = np.full((unique_Kc.size, n), np.nan)
+    for i, kc in enumerate(unique_Kc):
+        r = _get_analytical_roots(kc, n)
+        roots[i, :r.size] = r
+    roots = roots[inverse]
+    # missing roots contribute nothing to the sum
+    valid = ~np.isnan(roots)
+    roots = np.where(valid, roots, 0)
+    weights = np.where(valid, 1/(((Kc[:,None]**2)*(roots**2))+9*(Kc[:,None]+1)), 0)
+    decay = (K[:,None]*(roots**2))/((Ra[:,None])**2)
+
+    sum_roots = np.empty((Kc.size, t_flat.size))
+    chunk = max(1, max_elements//max(1, n*t_flat.size))
+    for start in range(0, Kc.size, chunk):
+        stop = start + chunk
+        terms = np.exp(-decay[start:stop,:,None]*t_flat[None,None,:])
+        sum_roots[start:stop] = np.einsum('pn,pnt->pt', weights[start:stop], terms)
+
+    step = (rho_c0-rho_i)[:,None]
+    rho = rho_c0[:,None]-step/(Kc[:,None]+1)+(6*Kc[:,None])*step*sum_roots
+    return rho.reshape(shape + t.shape)
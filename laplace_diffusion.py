@@ -0,0 +1,182 @@
+"""
+numerical laplace inversion of finite reservoir diffusion uptake
+
+A particle (sphere, cylinder or slab) initially at rho_i is exposed to a
+well mixed reservoir initially at rho_c0, and Kc is the ratio of the gas
+storage capacity of the reservoir to that of the particle. In the laplace
+domain the excess edge concentration U = rho_edge - rho_i is
+
+    U(s) = Kc*(rho_c0 - rho_i)/(s*(Kc + g(x))),    x = Ra*sqrt(s/K)
+
+with the geometry function
+
+    sphere    g = 3*(x*coth(x) - 1)/x^2
+    cylinder  g = 2*I1(x)/(x*I0(x))
+    slab      g = tanh(x)/x              (Ra is the half thickness)
+
+which is inverted with the fixed Talbot contour or the Gaver-Stehfest
+algorithm, vectorized over time. For the sphere this is the closed form of
+the Carslaw Jaeger series in kinetic_models and needs no eigenvalues.
+"""
+GEOMETRIES = ('sphere', 'cylinder', 'slab')
+
+
+def _geometry_function(x, geometry):
+    import numpy as np
+    if geometry == 'sphere':
+        return 3*(x/np.tanh(x) - 1)/x**2
+    if geometry == 'cylinder':
+        from scipy.special import ive
+        # the exponential scaling of ive cancels in the ratio
+        return 2*ive(1, x)/(x*ive(0, x))
+    if geometry == 'slab':
+        return np.tanh(x)/x
+    raise ValueError('invalid geometry {}'.format(geometry))
+
+
+def edge_concentration_transform(s, rho_c0, rho_i, Kc, K, Ra, geometry='sphere'):
+    """laplace transform of the edge concentration
+
+    Arguments:
+        s {numpy array} -- laplace variable, real or complex
+        rho_c0 {float} -- initial concentration at edge mol/m^3
+        rho_i {float} -- initial concentration at centre mol/m^3
+        Kc {float} -- gas storage capacity ratio
+        K {float} -- gas diffusion coefficient
+        Ra {float} -- particle radius
+
+    Keyword Arguments:
+        geometry {str} -- sphere, cylinder or slab (default: {'sphere'})
+
+    Returns:
+        numpy array -- transform of rho_edge(t)
+    """
+    import numpy as np
+    x = Ra*np.sqrt(s/K)
+    g = _geometry_function(x, geometry)
+    return rho_i/s + Kc*(rho_c0 - rho_i)/(s*(Kc + g))
+
+
+def talbot(transform, t, M=32):
+    """invert a laplace transform with the fixed Talbot contour (Abate and Valko)
+
+    Arguments:
+        transform {callable} -- F(s) accepting a complex numpy array
+        t {numpy array} -- positive times
+
+    Keyword Arguments:
+        M {int} -- number of contour nodes (default: {32})
+
+    Returns:
+        numpy array -- f(t)
+    """
+    import numpy as np
+    t = np.asarray(t, dtype=float)[..., None]
+    r = 2*M/(5*t)
+    theta = np.pi*np.arange(1, M)/M
+    cot = 1/np.tan(theta)
+    s = r*theta*(cot + 1j)
+    sigma = theta + (theta*cot - 1)*cot
+    terms = np.real(np.exp(t*s)*transform(s)*(1 + 1j*sigma))
+    first = 0.5*np.exp(r*t)*np.real(transform(r + 0j))
+    return (r/M*(first + terms.sum(axis=-1, keepdims=True)))[..., 0]
+
+
+def _stehfest_coefficients(N):
+    from math import factorial
+    half = N//2
+    V = []
+    for k in range(1, N + 1):
+        total = 0.0
+        for j in range((k + 1)//2, min(k, half) + 1):
+            total += (j**half*factorial(2*j))/(factorial(half - j)*factorial(j)*factorial(j - 1)
+                                              *factorial(k - j)*factorial(2*j - k))
+        V.append((-1)**(k + half)*total)
+    return V
+
+
+def stehfest(transform, t, N=14):
+    """invert a laplace transform with the Gaver-Stehfest algorithm
+
+    Arguments:
+        transform {callable} -- F(s) accepting a real numpy array
+        t {numpy array} -- positive times
+
+    Keyword Arguments:
+        N {int} -- even number of terms, 12 to 16 suits double precision (default: {14})
+
+    Returns:
+        numpy array -- f(t)
+    """
+    import numpy as np
+    if N % 2:
+        raise ValueError('the number of Stehfest terms must be even')
+    t = np.asarray(t, dtype=float)[..., None]
+    V = np.array(_stehfest_coefficients(N))
+    k = np.arange(1, N + 1)
+    a = np.log(2)/t
+    return (a*(V*transform(k*a)).sum(axis=-1, keepdims=True))[..., 0]
+
+
+def laplace_edge_concentration(t, rho_c0, rho_i, Kc, K, Ra, geometry='sphere', method='talbot', **kwargs):
+    """edge concentration by numerical laplace inversion
+
+    Arguments:
+        t {array_like} -- time in seconds
+        rho_c0 {float} -- initial concentration at edge mol/m^3
+        rho_i {float} -- initial concentration at centre mol/m^3
+        Kc {float} -- gas storage capacity ratio
+        K {float} -- gas diffusion coefficient
+        Ra {float} -- particle radius
+
+    Keyword Arguments:
+        geometry {str} -- sphere, cylinder or slab (default: {'sphere'})
+        method {str} -- talbot or stehfest (default: {'talbot'})
+        **kwargs -- M for talbot, N for stehfest
+
+    Returns:
+        float or numpy array -- gas concentration at edge
+    """
+    import numpy as np
+    if geometry not in GEOMETRIES:
+        raise ValueError('invalid geometry {}'.format(geometry))
+    if method == 'talbot':
+        invert = talbot
+    elif method == 'stehfest':
+        invert = stehfest
+    else:
+        raise ValueError('invalid laplace inversion method {}'.format(method))
+    t = np.asarray(t, dtype=float)
+    rho = np.full(t.shape, float(rho_c0))
+    positive = t > 0
+    if positive.any():
+        transform = lambda s: edge_concentration_transform(s, rho_c0, rho_i, Kc, K, Ra, geometry)
+        rho[positive] = invert(transform, t[positive], **kwargs)
+    if t.ndim == 0:
+        return float(rho)
+    return rho
+
+
+def compare_with_series(t, rho_c0, rho_i, Kc, K, Ra, n=99, method='talbot', **kwargs):
+    """largest difference between the laplace inversion and the Carslaw Jaeger series
+
+    Arguments:
+        t {array_like} -- time in seconds
+        rho_c0 {float} -- initial concentration at edge mol/m^3
+        rho_i {float} -- initial concentration at centre mol/m^3
+        Kc {float} -- gas storage capacity ratio
+        K {float} -- gas diffusion coefficient
+        Ra {float} -- particle radius
+
+    Keyword Arguments:
+        n {int} -- number of roots of the series (default: {99})
+        method {str} -- talbot or stehfest (default: {'talbot'})
+
+    Returns:
+        float -- max |laplace - series|/|rho_c0 - rho_i|
+    """
+    import numpy as np
+    from kinetic_models import cj_analytical_edge_concentration
+    laplace = laplace_edge_concentration(t, rho_c0, rho_i, Kc, K, Ra, 'sphere', method, **kwargs)
+    series = cj_analytical_edge_concentration(t, rho_c0, rho_i, Kc, K, Ra, n, tol=1e-12)
+    return float(np.max(np.abs(laplace - series))/abs(rho_c0 - rho_i))
@@ -0,0 +1,89 @@
+"""
+lazy module imports and an import time report
+
+lazy_import returns a stand-in that imports the module on first attribute
+access and then keeps every attribute it hands out, so after the first use
+a lookup such as CP.PropsSI costs no more than on the module itself. Heavy
+dependencies (CoolProp, SciPy, Plotly) are bound this way at module level,
+which keeps them out of the start up of the Excel UDF server and Dash app
+while resolving them only once.
+
+    python lazy_imports.py XLWings scratch
+
+prints the slowest imports of a cold start, from python -X importtime.
+"""
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """module stand-in imported on first attribute access"""
+
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(self.__dict__['_name'])
+        return module
+
+    def __getattr__(self, attribute):
+        value = getattr(self._load(), attribute)
+        # later lookups find the attribute directly and skip __getattr__
+        self.__dict__[attribute] = value
+        return value
+
+    def __repr__(self):
+        state = 'loaded' if self.__dict__['_module'] is not None else 'not loaded'
+        return '<lazy module {} ({})>'.format(self.__dict__['_name'], state)
+
+
+def lazy_import(name):
+    """module name, imported on first use; the module itself if it is already imported"""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    return LazyModule(name)
+
+
+def import_time_report(modules, top=15, python=sys.executable):
+    """cumulative import times of a cold start of modules, slowest first
+
+    Arguments:
+        modules {list} -- module names imported in one fresh interpreter
+
+    Keyword Arguments:
+        top {int} -- number of imports listed (default: {15})
+        python {str} -- interpreter to start (default: {sys.executable})
+
+    Returns:
+        tuple -- (total seconds, [(seconds, module)] of the slowest imports)
+    """
+    import os
+    import subprocess
+    import time
+    statement = '; '.join('import {}'.format(m) for m in modules)
+    start = time.perf_counter()
+    process = subprocess.run([python, '-X', 'importtime', '-c', statement], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+    total = time.perf_counter() - start
+    if process.returncode:
+        raise ImportError(process.stderr.strip().splitlines()[-1])
+    timings = []
+    for line in process.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        timings.append((int(cumulative)*1e-6, name.strip()))
+    timings.sort(reverse=True)
+    return total, timings[:top]
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or ['XLWings']
+    total, timings = import_time_report(names)
+    print('cold start of {}: {:.3f} s'.format(', '.join(names), total))
+    for seconds, name in timings:
+        print('{:>9.3f} s  {}'.format(seconds, name))
@@ -0,0 +1,87 @@
+"""
+scipy.optimize.least_squares with fit statistics
+
+The model functions of isotherm_fitting, kinetic_fitting and
+diffusion_inversion return their residual and analytic jacobian together,
+so least_squares_with_stats evaluates them once per parameter vector and
+hands both halves to least_squares. The covariance of the parameters is
+estimated from the jacobian at the solution, cov = inv(J'J)*rss/(n - p),
+with AIC = n*ln(rss/n) + 2*p and BIC = n*ln(rss/n) + p*ln(n). map_fits
+runs the fits of many datasets across a process pool; on Windows, any
+call with more than one process must come from under an
+if __name__ == '__main__' guard.
+"""
+from collections import namedtuple
+
+LeastSquaresFit = namedtuple('LeastSquaresFit', ['params', 'cov', 'aic', 'bic', 'rss', 'nfev', 'success'])
+
+
+def least_squares_with_stats(residual_and_jacobian, x0, bounds=(-float('inf'), float('inf')), **kwargs):
+    """least squares fit with parameter covariance, AIC and BIC
+
+    Arguments:
+        residual_and_jacobian {callable} -- (residual, jacobian) at a parameter vector
+        x0 {array_like} -- starting parameters, strictly inside bounds
+
+    Keyword Arguments:
+        bounds {tuple} -- (lower, upper) bounds of the parameters (default: {(-inf, inf)})
+        **kwargs -- passed to scipy.optimize.least_squares, x_scale='jac' and method='trf' unless given
+
+    Returns:
+        LeastSquaresFit -- params, cov, aic, bic, rss, nfev and success
+    """
+    import numpy as np
+    from scipy.optimize import least_squares
+    cache = {}
+
+    def evaluate(x):
+        # residual and jacobian share one evaluation of the model
+        key = tuple(x)
+        if key not in cache:
+            cache.clear()
+            cache[key] = residual_and_jacobian(x)
+        return cache[key]
+
+    kwargs.setdefault('x_scale', 'jac')
+    kwargs.setdefault('method', 'trf')
+    solution = least_squares(lambda x: evaluate(x)[0], x0, jac=lambda x: evaluate(x)[1], bounds=bounds, **kwargs)
+    rss = float(np.dot(solution.fun, solution.fun))
+    n_points = solution.fun.size
+    n_params = solution.x.size
+    J = solution.jac
+    dof = n_points - n_params
+    try:
+        cov = np.linalg.inv(J.T @ J)*(rss/dof if dof > 0 else np.nan)
+    except np.linalg.LinAlgError:
+        cov = np.full((n_params, n_params), np.nan)
+    with np.errstate(divide='ignore'):
+        log_likelihood = n_points*np.log(rss/n_points)
+    return LeastSquaresFit(solution.x, cov, log_likelihood + 2*n_params, log_likelihood + n_params*np.log(n_points),
+                           rss, solution.nfev, bool(solution.success))
+
+
+def map_fits(function, items, processes=None, chunksize=None):
+    """apply a fit to every item, across a process pool if there is more than one worker
+
+    Arguments:
+        function {callable} -- top level function of one item, so it can be pickled
+        items {iterable} -- fit tasks
+
+    Keyword Arguments:
+        processes {int} -- worker processes, 1 fits serially, None uses every cpu (default: {None})
+        chunksize {int} -- items sent to a worker at a time, None splits the
+            items into four chunks per worker (default: {None})
+
+    Returns:
+        list -- function(item) for every item, in order
+    """
+    import os
+    items = list(items)
+    workers = min(processes or os.cpu_count() or 1, max(len(items), 1))
+    if chunksize is None:
+        chunksize = max(1, -(-len(items)//(4*workers)))
+    if workers == 1 or len(items) <= chunksize:
+        return [function(item) for item in items]
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(function, items, chunksize=chunksize))
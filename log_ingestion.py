@@ -0,0 +1,132 @@
+"""
+chunked streaming ingestion of raw rig pressure and temperature logs
+
+Logs of time, pressure and temperature are read a fixed number of rows at
+a time, from csv text or by memory mapping a binary export, so memory stays
+bounded whatever the size of the log. Every chunk is converted to SI units
+and its gas density (and moles in a given volume) computed in one
+vectorized pass, evaluating the equation of state once per distinct
+(pressure, temperature) state, and handed on as soon as it is done.
+
+    for chunk in ingest_log('rig.csv', 'methane', volume=5.91e-5):
+        ...
+"""
+from itertools import islice
+
+from convert_units import get_converter
+from manometric_reduction import unique_z
+
+R = 8.3144598
+CHUNK_ROWS = 2**18
+
+RESULT_DTYPE = [('time', float), ('pressure', float), ('temperature', float), ('rhom', float), ('moles', float)]
+
+
+def read_csv_chunks(path, chunk_rows=CHUNK_ROWS, columns=(0, 1, 2), delimiter=',', skip_header=1):
+    """read a csv log in chunks of rows
+
+    Arguments:
+        path {str} -- csv file
+
+    Keyword Arguments:
+        chunk_rows {int} -- rows per chunk (default: {CHUNK_ROWS})
+        columns {tuple} -- indices of the time, pressure and temperature columns (default: {(0, 1, 2)})
+        delimiter {str} -- column separator (default: {','})
+        skip_header {int} -- header lines to skip (default: {1})
+
+    Yields:
+        tuple -- (time, pressure, temperature) numpy arrays of one chunk
+    """
+    import numpy as np
+    with open(path) as f:
+        for _ in range(skip_header):
+            next(f, None)
+        while True:
+            lines = list(islice(f, chunk_rows))
+            if not lines:
+                break
+            data = np.loadtxt(lines, delimiter=delimiter, usecols=columns, ndmin=2)
+            yield data[:, 0], data[:, 1], data[:, 2]
+
+
+def read_binary_chunks(path, chunk_rows=CHUNK_ROWS, dtype='<f8', offset=0):
+    """memory map a binary log of (time, pressure, temperature) rows and read it in chunks
+
+    Arguments:
+        path {str} -- binary file of consecutive rows
+
+    Keyword Arguments:
+        chunk_rows {int} -- rows per chunk (default: {CHUNK_ROWS})
+        dtype {str or numpy dtype} -- type of every value in a row (default: {'<f8'})
+        offset {int} -- bytes before the first row, e.g. a header (default: {0})
+
+    Yields:
+        tuple -- (time, pressure, temperature) numpy arrays of one chunk
+    """
+    import numpy as np
+    row = np.dtype([('time', dtype), ('pressure', dtype), ('temperature', dtype)])
+    rows = np.memmap(path, dtype=row, mode='r', offset=offset)
+    for start in range(0, rows.size, chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        # copies only the chunk, the rest of the file stays on disk
+        yield (np.asarray(chunk['time'], dtype=float), np.asarray(chunk['pressure'], dtype=float),
+               np.asarray(chunk['temperature'], dtype=float))
+
+
+def process_chunks(chunks, gas, volume=None, pressure_units='bar_g', temperature_units='degC', backend='coolprop'):
+    """convert chunks to SI units and compute gas density and moles
+
+    Arguments:
+        chunks {iterable} -- (time, pressure, temperature) arrays, e.g. from read_csv_chunks
+        gas {str} -- CoolProp fluid name
+
+    Keyword Arguments:
+        volume {float} -- gas volume m^3 for the moles field, nan if None (default: {None})
+        pressure_units {str} -- pressure units of the log (default: {'bar_g'})
+        temperature_units {str} -- temperature units of the log (default: {'degC'})
+        backend {str} -- get_z backend, 'coolprop', 'table' or 'state' (default: {'coolprop'})
+
+    Yields:
+        numpy structured array -- time s, pressure Pa_a, temperature K, rhom mol/m^3 and moles of one chunk
+    """
+    import numpy as np
+    to_pascal = get_converter(pressure_units, 'Pa_a')
+    to_kelvin = get_converter(temperature_units, 'K')
+    for time, pressure, temperature in chunks:
+        result = np.empty(np.shape(time), dtype=RESULT_DTYPE)
+        result['time'] = time
+        P = to_pascal(pressure, out=result['pressure'])
+        T = to_kelvin(temperature, out=result['temperature'])
+        # rig logs repeat the same readings, so the EOS runs once per distinct state
+        z = unique_z(P, T, gas, backend) if P.size else np.empty(0)
+        np.divide(P, z*R*T, out=result['rhom'])
+        if volume is None:
+            result['moles'] = np.nan
+        else:
+            np.multiply(result['rhom'], volume, out=result['moles'])
+        yield result
+
+
+def ingest_log(path, gas, volume=None, binary=False, chunk_rows=CHUNK_ROWS, pressure_units='bar_g',
+               temperature_units='degC', backend='coolprop', **kwargs):
+    """stream a rig log through unit conversion and density calculation
+
+    Arguments:
+        path {str} -- csv or binary log of time, pressure and temperature
+        gas {str} -- CoolProp fluid name
+
+    Keyword Arguments:
+        volume {float} -- gas volume m^3 for the moles field (default: {None})
+        binary {bool} -- memory map a binary export instead of parsing csv (default: {False})
+        chunk_rows {int} -- rows per chunk (default: {CHUNK_ROWS})
+        pressure_units {str} -- pressure units of the log (default: {'bar_g'})
+        temperature_units {str} -- temperature units of the log (default: {'degC'})
+        backend {str} -- get_z backend, 'coolprop', 'table' or 'state' (default: {'coolprop'})
+        **kwargs -- passed to read_csv_chunks or read_binary_chunks
+
+    Yields:
+        numpy structured array -- one processed chunk at a time, see process_chunks
+    """
+    reader = read_binary_chunks if binary else read_csv_chunks
+    chunks = reader(path, chunk_rows=chunk_rows, **kwargs)
+    return process_chunks(chunks, gas, volume, pressure_units, temperature_units, backend)
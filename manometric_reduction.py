@@ -0,0 +1,77 @@
+"""
+vectorized manometric reduction of a whole injection sequence
+
+Each dose charges the reference cell from the initial pressure Pi to the
+charge pressure Pc and then opens it to the sample cell, so the system
+(reference plus void volume) equilibrates at Pe. The cumulative injected
+amount is the running sum of the moles added to the reference cell, the
+excess adsorbed is what is left after removing the free gas at Pe, and the
+absolute adsorbed follows the absolute_surface correction.
+"""
+
+
+def unique_z(pressures, temperatures, gas, backend):
+    """evaluate Z once per distinct (P, T) state and scatter it back
+
+    Arguments:
+        pressures {array_like} -- pressure Pa_a, any shape
+        temperatures {array_like} -- temperature K, same shape as pressures
+        gas {str} -- CoolProp fluid name
+        backend {str} -- get_z backend, 'coolprop', 'table' or 'state'
+
+    Returns:
+        numpy array -- compressibility factor, shaped as pressures
+    """
+    import numpy as np
+    from calculate_moles import get_z
+    # a complex number holds the (P, T) pair exactly and sorts much faster than rows
+    states = np.ravel(pressures) + 1j*np.ravel(temperatures)
+    unique_states, inverse = np.unique(states, return_inverse=True)
+    z = np.asarray(get_z(unique_states.real, unique_states.imag, gas, backend), dtype=float)
+    return z[inverse.ravel()].reshape(np.shape(pressures))
+
+
+def reduce_injections(gas, reference_volume, void_volume, temperature, initial_pressure,
+                      charge_pressure, equilibrium_pressure, rho_ads=None,
+                      previously_injected=0, backend='coolprop'):
+    """reduce a sequence of doses to cumulative injected, excess and absolute adsorbed moles
+
+    Step k usually starts where step k-1 equilibrated, so the shared states
+    are de-duplicated and every property is evaluated only once.
+
+    Arguments:
+        gas {str} -- CoolProp fluid name
+        reference_volume {float} -- reference cell volume m^3
+        void_volume {float} -- void volume of the sample cell m^3
+        temperature {array_like} -- temperature of each step K
+        initial_pressure {array_like} -- reference cell pressure before charging Pa_a
+        charge_pressure {array_like} -- reference cell pressure after charging Pa_a
+        equilibrium_pressure {array_like} -- system pressure at equilibrium Pa_a
+
+    Keyword Arguments:
+        rho_ads {float} -- adsorbed phase density mol/m^3, absolute is nan if None (default: {None})
+        previously_injected {float} -- moles injected before the first step (default: {0})
+        backend {str} -- get_z backend, 'coolprop', 'table' or 'state' (default: {'coolprop'})
+
+    Returns:
+        numpy structured array -- fields injected, excess and absolute in moles, one row per step
+    """
+    import numpy as np
+    R = 8.3144598
+    T, Pi, Pc, Pe = np.broadcast_arrays(*(np.atleast_1d(np.asarray(x, dtype=float)) for x in
+                                          (temperature, initial_pressure, charge_pressure, equilibrium_pressure)))
+    z = unique_z(np.stack([Pi, Pc, Pe]), np.stack([T, T, T]), gas, backend)
+    zi, zc, ze = z
+
+    ni = (Pi*reference_volume)/(zi*R*T) #initial moles
+    nc = (Pc*reference_volume)/(zc*R*T) #charge moles
+    rho_g = Pe/(ze*R*T)
+
+    result = np.empty(T.shape, dtype=[('injected', float), ('excess', float), ('absolute', float)])
+    result['injected'] = previously_injected + np.cumsum(nc - ni)
+    result['excess'] = result['injected'] - rho_g*(reference_volume + void_volume)
+    if rho_ads is None:
+        result['absolute'] = np.nan
+    else:
+        result['absolute'] = result['excess']/(1-(rho_g/rho_ads))
+    return result
@@ -0,0 +1,101 @@
+"""
+pooled CoolProp AbstractState handles for batch property evaluation
+
+PropsSI parses the fluid name and builds a new backend state on every call.
+Here one low level AbstractState is kept per (backend, gas) and per thread,
+so repeated and batched evaluations only pay for the equation of state.
+Handles are never shared between threads, which makes evaluate safe to call
+from worker threads. The handles win on scalars and small batches; a single output over a large
+batch goes to vectorized PropsSI instead, whose loop over the points runs
+in C++ (see the get_z cases of benchmarks.py).
+"""
+import threading
+
+from lazy_imports import lazy_import
+
+CP = lazy_import('CoolProp.CoolProp')
+
+_local = threading.local()
+
+# points from which a single output is faster through vectorized PropsSI
+VECTORIZE_SIZE = 256
+
+
+def get_state(gas, backend='HEOS'):
+    """AbstractState of this thread for (backend, gas), created on first use
+
+    Arguments:
+        gas {str} -- CoolProp fluid name
+
+    Keyword Arguments:
+        backend {str} -- CoolProp backend, e.g. HEOS or REFPROP (default: {'HEOS'})
+
+    Returns:
+        CoolProp AbstractState
+    """
+    states = getattr(_local, 'states', None)
+    if states is None:
+        states = _local.states = {}
+    key = (backend, gas)
+    state = states.get(key)
+    if state is None:
+        state = states[key] = CP.AbstractState(backend, gas)
+    return state
+
+
+def evaluate(outputs, pressure, temperature, gas, backend='HEOS'):
+    """evaluate properties at every (pressure, temperature) point with this thread's handle
+
+    Arguments:
+        outputs {str or sequence} -- CoolProp output keys, e.g. 'Z' or ('Z', 'DMOLAR')
+        pressure {array_like} -- pressure Pa
+        temperature {array_like} -- temperature K, broadcast against pressure
+        gas {str} -- CoolProp fluid name
+
+    Keyword Arguments:
+        backend {str} -- CoolProp backend (default: {'HEOS'})
+
+    Returns:
+        numpy array -- one array per output stacked on the first axis, or a
+        single array for a single output key; nan where the state fails
+    """
+    import numpy as np
+    single = isinstance(outputs, str)
+    P, T = np.broadcast_arrays(np.asarray(pressure, dtype=float), np.asarray(temperature, dtype=float))
+    if single and P.size >= VECTORIZE_SIZE:
+        # every extra output would cost PropsSI a whole second pass, so only a single one goes there
+        try:
+            result = CP.PropsSI(outputs, 'P', P.ravel(), 'T', T.ravel(), '{}::{}'.format(backend, gas))
+        except ValueError:
+            # raised when no state at all can be calculated, the loop below leaves them nan
+            pass
+        else:
+            result = np.asarray(result, dtype=float).reshape(P.shape)
+            # PropsSI reports failed states as inf
+            result[~np.isfinite(result)] = np.nan
+            return result
+    keys = [CP.get_parameter_index(o) for o in ([outputs] if single else outputs)]
+    result = np.full((len(keys),) + P.shape, np.nan)
+    flat = result.reshape(len(keys), -1)
+    state = get_state(gas, backend)
+    PT_INPUTS = CP.PT_INPUTS
+    for i, (p, t) in enumerate(zip(P.ravel().tolist(), T.ravel().tolist())):
+        try:
+            state.update(PT_INPUTS, p, t)
+        except ValueError:
+            continue
+        for j, key in enumerate(keys):
+            flat[j, i] = state.keyed_output(key)
+    return result[0] if single else result
+
+
+def state_z(pressure, temperature, gas, backend='HEOS'):
+    """compressibility factor from the pooled handles, a float for scalar input"""
+    z = evaluate('Z', pressure, temperature, gas, backend)
+    return float(z) if z.ndim == 0 else z
+
+
+def state_rhom(pressure, temperature, gas, backend='HEOS'):
+    """molar density mol/m^3 from the pooled handles, a float for scalar input"""
+    rhom = evaluate('DMOLAR', pressure, temperature, gas, backend)
+    return float(rhom) if rhom.ndim == 0 else rhom
@@ -0,0 +1,342 @@
+"""
+tabulated gas properties for fast evaluation of get_z and get_rhom
+
+A table holds the compressibility factor Z of one gas on a uniform
+(pressure, temperature) grid and evaluates it by bicubic (Catmull-Rom)
+interpolation. The grid is refined at build time until the interpolation
+error measured against CoolProp at the cell centres is below a requested
+tolerance; cells that never reach it, and points outside the table, are
+evaluated with CoolProp instead.
+
+Built tables are saved to a versioned, checksummed binary file and loaded
+with numpy.memmap, so every process on the machine shares one page-cached
+copy. The directory is taken from the PROPERTY_TABLE_DIR environment
+variable and defaults to ~/.cache/python_scripts/property_tables.
+"""
+import os
+import struct
+import warnings
+import zlib
+
+from lazy_imports import lazy_import
+
+CP = lazy_import('CoolProp.CoolProp')
+
+R = 8.3144598
+
+FORMAT_VERSION = 1
+# part of the file name, so tables from an older error check are rebuilt
+BUILD_VERSION = 2
+_MAGIC = b'PTABLE\x00\x00'
+# magic, version, rows, columns, p_min, p_max, t_min, t_max, z offset, fallback offset, crc32, gas
+_HEADER = struct.Struct('<8sIII4dQQI64s')
+_ALIGNMENT = 64
+
+_tables = {}
+
+
+def coolprop_z(pressure, temperature, gas):
+    """calculate Z with CoolProp for any broadcastable pressure and temperature
+
+    Arguments:
+        pressure {array_like} -- pressure Pa
+        temperature {array_like} -- temperature K
+        gas {str} -- CoolProp fluid name
+
+    Returns:
+        numpy array -- compressibility factor, nan where CoolProp fails
+    """
+    import numpy as np
+    P, T = np.broadcast_arrays(np.asarray(pressure, dtype=float), np.asarray(temperature, dtype=float))
+    if P.size == 0:
+        return np.empty(P.shape)
+    try:
+        z = np.asarray(CP.PropsSI('Z', 'P', P.ravel(), 'T', T.ravel(), gas), dtype=float)
+    except ValueError:
+        # vectorized PropsSI raises when no point at all can be calculated
+        from property_service import evaluate
+        return evaluate('Z', P, T, gas)
+    z = np.where(np.isfinite(z), z, np.nan)
+    return z.reshape(P.shape)
+
+
+def _catmull_rom_weights(f):
+    import numpy as np
+    f2 = f*f
+    f3 = f2*f
+    return np.stack([
+        0.5*(-f3 + 2*f2 - f),
+        0.5*(3*f3 - 5*f2 + 2),
+        0.5*(-3*f3 + 4*f2 + f),
+        0.5*(f3 - f2)
+    ], axis=-1)
+
+
+def _pad(z):
+    """add one ghost node on every side by quadratic extrapolation"""
+    import numpy as np
+    z = np.concatenate([3*z[:1] - 3*z[1:2] + z[2:3], z, 3*z[-1:] - 3*z[-2:-1] + z[-3:-2]], axis=0)
+    z = np.concatenate([3*z[:, :1] - 3*z[:, 1:2] + z[:, 2:3], z, 3*z[:, -1:] - 3*z[:, -2:-1] + z[:, -3:-2]], axis=1)
+    return z
+
+
+class PropertyTable:
+    """compressibility factor of one gas on a uniform (P, T) grid
+
+    Arguments:
+        gas {str} -- CoolProp fluid name
+        pressure_range {tuple} -- (minimum, maximum) pressure Pa
+        temperature_range {tuple} -- (minimum, maximum) temperature K
+        z {numpy array} -- Z on the grid padded with one ghost node per side
+        fallback {numpy array} -- True for cells evaluated with CoolProp
+    """
+
+    def __init__(self, gas, pressure_range, temperature_range, z, fallback):
+        self.gas = gas
+        self.p_min, self.p_max = (float(p) for p in pressure_range)
+        self.t_min, self.t_max = (float(t) for t in temperature_range)
+        self.z_table = z
+        self.fallback = fallback
+        self.n_pressure = z.shape[0] - 2
+        self.n_temperature = z.shape[1] - 2
+        self.dp = (self.p_max - self.p_min)/(self.n_pressure - 1)
+        self.dt = (self.t_max - self.t_min)/(self.n_temperature - 1)
+
+    @classmethod
+    def build(cls, gas, pressure_range=(1e3, 2e7), temperature_range=(253.15, 373.15),
+              tol=1e-5, initial_nodes=(33, 17), max_nodes=257):
+        """build a table, doubling the resolution until the error inside every cell is below tol
+
+        The error is checked at the centre and at the four quarter points of
+        every cell, where the cubic interpolation is least accurate.
+
+        Arguments:
+            gas {str} -- CoolProp fluid name
+
+        Keyword Arguments:
+            pressure_range {tuple} -- pressure range Pa (default: {(1e3, 2e7)})
+            temperature_range {tuple} -- temperature range K (default: {(253.15, 373.15)})
+            tol {float} -- relative interpolation error on Z (default: {1e-5})
+            initial_nodes {tuple} -- starting number of (pressure, temperature) nodes (default: {(33, 17)})
+            max_nodes {int} -- largest number of nodes along either axis (default: {257})
+
+        Returns:
+            PropertyTable -- the table
+        """
+        import numpy as np
+        n_p, n_t = initial_nodes
+        while True:
+            p = np.linspace(pressure_range[0], pressure_range[1], n_p)
+            t = np.linspace(temperature_range[0], temperature_range[1], n_t)
+            z = coolprop_z(p[:, None], t[None, :], gas)
+            bad_nodes = np.isnan(z)
+            z = np.where(bad_nodes, 1.0, z)
+            table = cls(gas, pressure_range, temperature_range, _pad(z),
+                        np.zeros((n_p - 1, n_t - 1), dtype=bool))
+            error = np.zeros((n_p - 1, n_t - 1))
+            for fu, fv in ((0.5, 0.5), (0.25, 0.25), (0.25, 0.75), (0.75, 0.25), (0.75, 0.75)):
+                P, T = np.broadcast_arrays((p[:-1] + fu*np.diff(p))[:, None], (t[:-1] + fv*np.diff(t))[None, :])
+                exact = coolprop_z(P, T, gas)
+                interpolated = table._interpolate(P.ravel(), T.ravel()).reshape(P.shape)
+                with np.errstate(invalid='ignore'):
+                    # np.maximum keeps the nan of a failed CoolProp point, which fails the cell
+                    error = np.maximum(error, np.abs(interpolated - exact)/np.abs(exact))
+            # cells touching a failed node cannot be trusted
+            bad_cells = bad_nodes[1:, 1:] | bad_nodes[:-1, 1:] | bad_nodes[1:, :-1] | bad_nodes[:-1, :-1]
+            failed = ~(error <= tol) | bad_cells
+            if not failed.any() or 2*n_p - 1 > max_nodes:
+                # the 4x4 stencil of a neighbouring cell reaches into a failed cell
+                padded = np.pad(failed, 1)
+                table.fallback = np.zeros_like(failed)
+                for di in range(3):
+                    for dj in range(3):
+                        table.fallback |= padded[di:di + failed.shape[0], dj:dj + failed.shape[1]]
+                return table
+            n_p = 2*n_p - 1
+            if 2*n_t - 1 <= max_nodes:
+                n_t = 2*n_t - 1
+
+    def _locate(self, pressure, temperature):
+        import numpy as np
+        u = (pressure - self.p_min)/self.dp
+        v = (temperature - self.t_min)/self.dt
+        i = np.clip(np.floor(u).astype(np.intp), 0, self.n_pressure - 2)
+        j = np.clip(np.floor(v).astype(np.intp), 0, self.n_temperature - 2)
+        return i, j, u - i, v - j
+
+    def _interpolate(self, pressure, temperature):
+        import numpy as np
+        i, j, fu, fv = self._locate(pressure, temperature)
+        offsets = np.arange(4)
+        stencil = self.z_table[i[:, None, None] + offsets[None, :, None],
+                               j[:, None, None] + offsets[None, None, :]]
+        return np.einsum('na,nb,nab->n', _catmull_rom_weights(fu), _catmull_rom_weights(fv), stencil)
+
+    def z(self, pressure, temperature):
+        """interpolate Z, falling back to CoolProp outside the table
+
+        Arguments:
+            pressure {array_like} -- pressure Pa
+            temperature {array_like} -- temperature K
+
+        Returns:
+            float or numpy array -- compressibility factor, a float for scalar input
+        """
+        import numpy as np
+        P, T = np.broadcast_arrays(np.asarray(pressure, dtype=float), np.asarray(temperature, dtype=float))
+        shape = P.shape
+        P = P.ravel()
+        T = T.ravel()
+        inside = (P >= self.p_min) & (P <= self.p_max) & (T >= self.t_min) & (T <= self.t_max)
+        z = np.empty(P.shape)
+        if inside.any():
+            i, j, _, _ = self._locate(P[inside], T[inside])
+            use_table = np.zeros(P.shape, dtype=bool)
+            use_table[inside] = ~self.fallback[i, j]
+        else:
+            use_table = inside
+        z[use_table] = self._interpolate(P[use_table], T[use_table])
+        if not use_table.all():
+            z[~use_table] = coolprop_z(P[~use_table], T[~use_table], self.gas)
+        # as the coolprop and state backends of get_z
+        return float(z[0]) if not shape else z.reshape(shape)
+
+    def rhom(self, pressure, temperature):
+        """molar density P/(Z*R*T) in mol/m^3, a float for scalar input"""
+        import numpy as np
+        rhom = np.asarray(pressure)/(self.z(pressure, temperature)*R*np.asarray(temperature))
+        return float(rhom) if np.ndim(rhom) == 0 else rhom
+
+
+def _aligned(offset):
+    return -(-offset//_ALIGNMENT)*_ALIGNMENT
+
+
+def save_property_table(table, path):
+    """write a table to path atomically
+
+    Arguments:
+        table {PropertyTable} -- the table
+        path {str} -- file name
+    """
+    import numpy as np
+    z = np.ascontiguousarray(table.z_table, dtype='<f8')
+    fallback = np.ascontiguousarray(table.fallback, dtype=np.uint8)
+    z_offset = _aligned(_HEADER.size)
+    fallback_offset = _aligned(z_offset + z.nbytes)
+    checksum = zlib.crc32(fallback.tobytes(), zlib.crc32(z.tobytes()))
+    header = _HEADER.pack(_MAGIC, FORMAT_VERSION, z.shape[0], z.shape[1],
+                          table.p_min, table.p_max, table.t_min, table.t_max,
+                          z_offset, fallback_offset, checksum, table.gas.encode())
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    with open(temporary, 'wb') as f:
+        f.write(header)
+        f.seek(z_offset)
+        f.write(z.tobytes())
+        f.seek(fallback_offset)
+        f.write(fallback.tobytes())
+    os.replace(temporary, path)
+
+
+def load_property_table(path, verify=True):
+    """memory-map a table written by save_property_table
+
+    Arguments:
+        path {str} -- file name
+
+    Keyword Arguments:
+        verify {bool} -- check the crc32 of the data (default: {True})
+
+    Raises:
+        ValueError -- if the file is not a table of this format version or is corrupt
+
+    Returns:
+        PropertyTable -- the table backed by read-only memory maps
+    """
+    import numpy as np
+    with open(path, 'rb') as f:
+        raw = f.read(_HEADER.size)
+    if len(raw) != _HEADER.size:
+        raise ValueError('{} is not a property table'.format(path))
+    (magic, version, rows, columns, p_min, p_max, t_min, t_max,
+     z_offset, fallback_offset, checksum, gas) = _HEADER.unpack(raw)
+    if magic != _MAGIC:
+        raise ValueError('{} is not a property table'.format(path))
+    if version != FORMAT_VERSION:
+        raise ValueError('{} has format version {}, expected {}'.format(path, version, FORMAT_VERSION))
+    if os.path.getsize(path) < fallback_offset + (rows - 3)*(columns - 3):
+        raise ValueError('{} is truncated'.format(path))
+    z = np.memmap(path, dtype='<f8', mode='r', offset=z_offset, shape=(rows, columns))
+    fallback = np.memmap(path, dtype=np.uint8, mode='r', offset=fallback_offset,
+                         shape=(rows - 3, columns - 3))
+    if verify and zlib.crc32(fallback, zlib.crc32(z)) != checksum:
+        raise ValueError('{} failed its checksum'.format(path))
+    return PropertyTable(gas.rstrip(b'\x00').decode(), (p_min, p_max), (t_min, t_max),
+                         z, fallback.view(bool))
+
+
+def _default_directory():
+    return os.environ.get('PROPERTY_TABLE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'python_scripts', 'property_tables'))
+
+
+def _coolprop_version():
+    # read from the package metadata so that loading a table does not import CoolProp
+    from importlib.metadata import version, PackageNotFoundError
+    try:
+        return version('CoolProp')
+    except PackageNotFoundError:
+        return None
+
+
+def _table_path(directory, gas, kwargs):
+    key = repr((FORMAT_VERSION, BUILD_VERSION, _coolprop_version(), gas, sorted(kwargs.items())))
+    return os.path.join(directory, '{}-{:08x}.ptab'.format(gas, zlib.crc32(key.encode())))
+
+
+def get_property_table(gas, directory=None, **kwargs):
+    """return the table for gas, loading it from disk or building it on first use
+
+    Arguments:
+        gas {str} -- CoolProp fluid name
+
+    Keyword Arguments:
+        directory {str} -- table directory, False to keep tables in memory only (default: {None})
+        **kwargs -- passed to PropertyTable.build
+
+    Returns:
+        PropertyTable -- the cached table
+    """
+    key = (gas, tuple(sorted(kwargs.items())))
+    table = _tables.get(key)
+    if table is not None:
+        return table
+    if directory is False:
+        table = PropertyTable.build(gas, **kwargs)
+    else:
+        directory = directory or _default_directory()
+        path = _table_path(directory, gas, kwargs)
+        try:
+            table = load_property_table(path)
+        except FileNotFoundError:
+            pass
+        except ValueError as error:
+            warnings.warn('rebuilding property table: {}'.format(error))
+        if table is None:
+            table = PropertyTable.build(gas, **kwargs)
+            try:
+                os.makedirs(directory, exist_ok=True)
+                save_property_table(table, path)
+                table = load_property_table(path, verify=False)
+            except OSError as error:
+                warnings.warn('could not save property table: {}'.format(error))
+    _tables[key] = table
+    return table
+
+
+def table_z(pressure, temperature, gas):
+    return get_property_table(gas).z(pressure, temperature)
+
+
+def table_rhom(pressure, temperature, gas):
+    return get_property_table(gas).rhom(pressure, temperature)
@@ -1,12 +1,28 @@
 import dash
 import dash_core_components as dcc 
 import dash_html_components as html
-from dash.dependencies import Input, Output
-import plotly.graph_objects as go
+from dash.dependencies import Input, Output, State
 import numpy as np
-from kinetic_models import cj_analytical_edge_concentration
+import os
+import threading
+import uuid
+from functools import lru_cache
+from kinetic_models import cj_analytical_edge_concentration, cj_analytical_edge_concentration_grid
 from convert_units import convert_pressure
 from calculate_moles import get_rhom
+from lazy_imports import lazy_import
+
+# plotly is only needed once a figure is drawn
+go = lazy_import('plotly.graph_objects')
+
+# parameters the sweep can put on an axis, with the (min, max) of their slider
+SWEEP_PARAMETERS = {
+    'permeability': ('Permeability (5e-x m2)', (15, 25)),
+    'adsorption_uptake': ('Adsorption uptake', (0.001, 1)),
+    'particle_radius': ('Particle radius (cm)', (0.1, 5)),
+    'initial_pressure': ('Initial Pressure (bar)', (0.001, 10)),
+    'charge_pressure': ('Charge Pressure (bar)', (0.001, 10)),
+}
 
 app = dash.Dash()
 app.layout = html.Div([
@@ -95,7 +111,57 @@ app.layout = html.Div([
             10 : '10 bar'
         }
     ),
-    html.Div(id='chargepressure_output')
+    html.Div(id='chargepressure_output'),
+    html.Hr(),
+    html.H1(children = 'Parameter Sweep: Edge Pressure (bar)',
+            style = {
+                'textAlign':'center'
+            }
+    ),
+    html.Label('Sweep x axis:'),
+    dcc.Dropdown(
+        id = 'sweep_x',
+        options = [{'label': label, 'value': name} for name, (label, _) in SWEEP_PARAMETERS.items()],
+        value = 'permeability'
+    ),
+    html.Label('Sweep y axis:'),
+    dcc.Dropdown(
+        id = 'sweep_y',
+        options = [{'label': label, 'value': name} for name, (label, _) in SWEEP_PARAMETERS.items()],
+        value = 'particle_radius'
+    ),
+    html.Label('Sweep time (hours):'),
+    dcc.Input(
+        id = 'sweep_time',
+        type = 'number',
+        min = 0, 
+        max = 10, 
+        value = 5
+    ),
+    html.Label('Grid points per axis:'),
+    dcc.Input(
+        id = 'sweep_resolution',
+        type = 'number',
+        min = 2, 
+        max = 200, 
+        value = 40
+    ),
+    html.Button('Run sweep', id = 'sweep_run'),
+    html.Button('Cancel', id = 'sweep_cancel'),
+    html.Div(id='sweep_status'),
+    dcc.Graph(
+        id = 'sweep_heatmap'
+    ),
+    # polls the running sweep so finished chunks show up as they arrive,
+    # enabled only while a sweep is running
+    dcc.Interval(
+        id = 'sweep_interval',
+        interval = 1000,
+        disabled = True
+    ),
+    dcc.Store(
+        id = 'sweep_job'
+    )
 ])
 
 
@@ -142,6 +208,106 @@ def update_output(value):
     return '{:.2f} cms'.format(round(value,2))
 
 #--------------
+Vr = 5.91e-5 # m3 
+Vs = 3.44e-5 # m3
+R = 8.314 # m3⋅Pa/(K⋅mol)
+T = 318 # K
+M = 1.51e-2 # kg
+Vgb = 3.71e-4 # m3/kg
+phi = 5.08e-2 # no units
+Vc = 2.88e-5 # m3
+mu = 1.17e-5 #Pa s
+n = 20 # no units
+
+# every curve is computed once up to the end of the time slider and sliced by max_time;
+# log spacing keeps short max_time resolved, 1 s still gets about 180 points
+FULL_TIME = np.geomspace(0.1, 10*60*60, 1001) # seconds
+CACHE_SIZE = 8192 # curves, about 8 kB each
+
+# (min, max, step) of the model sliders, as in the layout
+PERMEABILITY_SLIDER = (15, 25, 1)
+ADSORPTION_SLIDER = (0.001, 1, 0.1)
+RADIUS_SLIDER = (0.1, 5, 0.1)
+PRESSURE_SLIDER = (0.001, 10, 1)
+
+_curves = {}
+
+
+def _key(value):
+    # slider values arrive as floats, rounding makes equal positions equal keys
+    return round(float(value), 6)
+
+
+def _slider_values(minimum, maximum, step):
+    values = np.arange(minimum, maximum, step)
+    return [_key(v) for v in np.append(values[values < maximum - 1e-9], maximum)]
+
+
+@lru_cache(maxsize=1024)
+def _densities(initial_pressure, charge_pressure):
+    rho_i = get_rhom(convert_pressure(initial_pressure,'bar_a','Pa_a'),T,'methane')
+    rho_c = get_rhom(convert_pressure(charge_pressure,'bar_a','Pa_a'),T,'methane')
+    rho_c0 = (rho_c*Vr + rho_i*Vc)/(Vr+Vc)
+    return rho_i, rho_c0
+
+
+def _model_parameters(permeability, adsorption_uptake, particle_radius, rho_c0):
+    k = 5/10**(permeability) # m2
+    Ka = adsorption_uptake # no units
+    R_a = particle_radius/100 # meters
+    Kc = Vc/(Vgb*M*(phi+(1-phi)*Ka))
+    K = (k*rho_c0*R*T)/(mu*(phi+(1-phi)*Ka))
+    return Kc, K, R_a
+
+
+def _store(key, curve):
+    curve.setflags(write=False)
+    if len(_curves) >= CACHE_SIZE:
+        # forget the oldest curve
+        _curves.pop(next(iter(_curves)), None)
+    _curves[key] = curve
+
+
+def edge_pressure_curve(permeability, initial_pressure, charge_pressure, adsorption_uptake, particle_radius):
+    """edge pressure in bar_g over FULL_TIME, memoized on the slider values"""
+    key = tuple(_key(v) for v in (permeability, initial_pressure, charge_pressure, adsorption_uptake, particle_radius))
+    curve = _curves.get(key)
+    if curve is None:
+        permeability, initial_pressure, charge_pressure, adsorption_uptake, particle_radius = key
+        rho_i, rho_c0 = _densities(initial_pressure, charge_pressure)
+        Kc, K, R_a = _model_parameters(permeability, adsorption_uptake, particle_radius, rho_c0)
+        edge_concentration = cj_analytical_edge_concentration(FULL_TIME,rho_c0,rho_i,Kc,K,R_a,n)
+        curve = np.asarray(convert_pressure(edge_concentration*R*T,'Pa_a','bar_g'), dtype=float)
+        _store(key, curve)
+    return curve
+
+
+def warm_up(initial_pressure=1, charge_pressure=5):
+    """precompute every permeability, adsorption and radius slider position with the batched engine
+
+    The curves cover every max_time. The pressure sliders only enter
+    through the densities, which are precomputed for every position; the
+    curves of other pressures are computed on first use.
+    """
+    pressures = _slider_values(*PRESSURE_SLIDER)
+    for initial in pressures:
+        for charge in pressures:
+            _densities(initial, charge)
+    initial_pressure, charge_pressure = _key(initial_pressure), _key(charge_pressure)
+    rho_i, rho_c0 = _densities(initial_pressure, charge_pressure)
+    permeability = np.array(_slider_values(*PERMEABILITY_SLIDER))
+    adsorption_uptake = np.array(_slider_values(*ADSORPTION_SLIDER))
+    particle_radius = np.array(_slider_values(*RADIUS_SLIDER))
+    Kc, K, R_a = _model_parameters(permeability[:,None,None], adsorption_uptake[None,:,None],
+                                   particle_radius[None,None,:], rho_c0)
+    edge_concentration = cj_analytical_edge_concentration_grid(FULL_TIME,rho_c0,rho_i,Kc,K,R_a,n)
+    edge_pressure = convert_pressure(edge_concentration*R*T,'Pa_a','bar_g')
+    for index in np.ndindex(edge_pressure.shape[:-1]):
+        i, j, l = index
+        key = (permeability[i], initial_pressure, charge_pressure, adsorption_uptake[j], particle_radius[l])
+        _store(tuple(float(v) for v in key), np.array(edge_pressure[index]))
+
+
 @app.callback(
     Output('rig_pressure', 'figure'),
     [Input('max_time', 'value'),
@@ -152,45 +318,174 @@ def update_output(value):
      Input('particle_radius', 'value')])
 def update_graph(max_time, permeability, initial_pressure, charge_pressure, adsorption_uptake, particle_radius):
     
-    Vr = 5.91e-5 # m3 
-    Vs = 3.44e-5 # m3
-    R = 8.314 # m3⋅Pa/(K⋅mol)
-    T = 318 # K
-    M = 1.51e-2 # kg
-    Vgb = 3.71e-4 # m3/kg
-    phi = 5.08e-2 # no units
-    Vc = 2.88e-5 # m3
-    mu = 1.17e-5 #Pa s
-
-    max_t = max_time # seconds
-    k = 5/10**(permeability) # m2
-    P_i = initial_pressure # bars
-    P_c = charge_pressure # bars
-    Ka = adsorption_uptake # no units
-    R_a = particle_radius/100 # meters
-    n = 20 # no units
-
-    rho_i = get_rhom(convert_pressure(P_i,'bar_a','Pa_a'),T,'methane')
-    rho_c = get_rhom(convert_pressure(P_c,'bar_a','Pa_a'),T,'methane')
-    rho_c0 = (rho_c*Vr + rho_i*Vc)/(Vr+Vc)
-
-    Kc = Vc/(Vgb*M*(phi+(1-phi)*Ka))
-
-    K = (k*rho_c0*R*T)/(mu*(phi+(1-phi)*Ka))
-
-    time = np.linspace(0.1,max_t,100)
-    time_hours = time/(60*60)
-    edge_concentration = cj_analytical_edge_concentration(time,rho_c0,rho_i,Kc,K,R_a,n)
-    edge_pressure = convert_pressure(edge_concentration*R*T,'Pa_a','bar_g')
+    edge_pressure = edge_pressure_curve(permeability, initial_pressure, charge_pressure, adsorption_uptake, particle_radius)
+    # changing only max_time re-slices the cached curve
+    stop = np.searchsorted(FULL_TIME, max_time, side='right')
+    time_hours = FULL_TIME[:stop]/(60*60)
 
     return {
         'data' : [
             go.Scatter(
                 x = time_hours,
-                y = edge_pressure
+                y = edge_pressure[:stop]
             )
         ]
     }
 
+#--------------
+SWEEP_ORDER = ('permeability', 'initial_pressure', 'charge_pressure', 'adsorption_uptake', 'particle_radius')
+MAX_SWEEP_JOBS = 16
+
+_sweep_jobs = {}
+_sweep_lock = threading.Lock()
+_sweep_pool = None
+
+
+def _sweep_executor():
+    global _sweep_pool
+    if _sweep_pool is None:
+        from concurrent.futures import ProcessPoolExecutor
+        _sweep_pool = ProcessPoolExecutor()
+    return _sweep_pool
+
+
+def _sweep_chunk(task):
+    """edge pressure in bar_g at one time for a chunk of parameter points"""
+    time, points = task
+    permeability, initial_pressure, charge_pressure, adsorption_uptake, particle_radius = points
+    # the densities only depend on the two pressures
+    pairs = {(_key(i), _key(c)) for i, c in zip(initial_pressure, charge_pressure)}
+    densities = {pair: _densities(*pair) for pair in pairs}
+    rho_i, rho_c0 = np.array([densities[(_key(i), _key(c))] for i, c in zip(initial_pressure, charge_pressure)]).T
+    Kc, K, R_a = _model_parameters(permeability, adsorption_uptake, particle_radius, rho_c0)
+    edge_concentration = cj_analytical_edge_concentration_grid([time],rho_c0,rho_i,Kc,K,R_a,n)[:,0]
+    return convert_pressure(edge_concentration*R*T,'Pa_a','bar_g')
+
+
+def cancel_sweep(job_id):
+    """cancel the chunks of a sweep that have not started yet"""
+    with _sweep_lock:
+        job = _sweep_jobs.get(job_id)
+    if job is not None:
+        job['cancelled'] = True
+        for future in job['futures']:
+            future.cancel()
+
+
+def start_sweep(x_name, y_name, resolution, time, values):
+    """submit a 2-D sweep over two parameters as row chunks to the process pool
+
+    Arguments:
+        x_name {str} -- parameter on the x axis, a key of SWEEP_PARAMETERS
+        y_name {str} -- parameter on the y axis
+        resolution {int} -- grid points per axis
+        time {float} -- time in seconds at which the edge pressure is evaluated
+        values {dict} -- slider values of the parameters that are not swept
+
+    Returns:
+        str -- job id
+    """
+    if x_name == y_name:
+        raise ValueError('the sweep axes must be different parameters')
+    x = np.linspace(*SWEEP_PARAMETERS[x_name][1], resolution)
+    y = np.linspace(*SWEEP_PARAMETERS[y_name][1], resolution)
+    job = {'x': x, 'y': y, 'x_name': x_name, 'y_name': y_name, 'z': np.full((y.size, x.size), np.nan),
+           'futures': [], 'cancelled': False}
+    # a few rows per chunk, so rows stream in and cancelling stops most of the work
+    for rows in np.array_split(np.arange(y.size), min(y.size, 4*(os.cpu_count() or 1))):
+        grid = {name: np.full((rows.size, x.size), float(values[name])) for name in SWEEP_ORDER}
+        grid[x_name] = np.broadcast_to(x, (rows.size, x.size))
+        grid[y_name] = np.broadcast_to(y[rows, None], (rows.size, x.size))
+        points = tuple(grid[name].ravel() for name in SWEEP_ORDER)
+        future = _sweep_executor().submit(_sweep_chunk, (time, points))
+        future.rows = rows
+        job['futures'].append(future)
+    job_id = uuid.uuid4().hex
+    with _sweep_lock:
+        _sweep_jobs[job_id] = job
+        while len(_sweep_jobs) > MAX_SWEEP_JOBS:
+            oldest = next(iter(_sweep_jobs))
+            for future in _sweep_jobs.pop(oldest)['futures']:
+                future.cancel()
+    return job_id
+
+
+def sweep_progress(job_id):
+    """copy finished chunks into the job's grid
+
+    Returns:
+        tuple -- (job, finished chunks, total chunks), job is None for an unknown id
+    """
+    with _sweep_lock:
+        job = _sweep_jobs.get(job_id)
+    if job is None:
+        return None, 0, 0
+    finished = 0
+    for future in job['futures']:
+        if future.done() and not future.cancelled():
+            if future.exception() is None:
+                job['z'][future.rows] = np.reshape(future.result(), (future.rows.size, job['x'].size))
+            finished += 1
+    return job, finished, len(job['futures'])
+
+
+@app.callback(
+    Output('sweep_job', 'data'),
+    [Input('sweep_run', 'n_clicks'),
+     Input('sweep_cancel', 'n_clicks')],
+    [State('sweep_job', 'data'),
+     State('sweep_x', 'value'),
+     State('sweep_y', 'value'),
+     State('sweep_resolution', 'value'),
+     State('sweep_time', 'value'),
+     State('permeability', 'value'),
+     State('initial_pressure', 'value'),
+     State('charge_pressure', 'value'),
+     State('adsorption_uptake', 'value'),
+     State('particle_radius', 'value')])
+def control_sweep(run_clicks, cancel_clicks, job_id, x_name, y_name, resolution, sweep_time, *slider_values):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if job_id is not None:
+        # a new sweep replaces the previous one of this page
+        cancel_sweep(job_id)
+    if 'sweep_run.n_clicks' not in triggered or not run_clicks or x_name == y_name:
+        return job_id
+    values = dict(zip(SWEEP_ORDER, slider_values))
+    return start_sweep(x_name, y_name, int(resolution or 40), float(sweep_time or 0)*60*60, values)
+
+
+@app.callback(
+    [Output('sweep_heatmap', 'figure'),
+     Output('sweep_status', 'children'),
+     Output('sweep_interval', 'disabled')],
+    [Input('sweep_interval', 'n_intervals'),
+     Input('sweep_job', 'data')])
+def update_sweep(n_intervals, job_id):
+    job, finished, total = sweep_progress(job_id)
+    if job is None or job.get('rendered'):
+        # nothing more can arrive, stop polling
+        return dash.no_update, dash.no_update, True
+    status = '{} of {} chunks'.format(finished, total)
+    if job['cancelled']:
+        status += ', cancelled'
+    # stop redrawing and polling once nothing more can arrive, a new job id enables it again
+    job['rendered'] = finished == total or (job['cancelled'] and all(f.done() for f in job['futures']))
+    return {
+        'data' : [
+            go.Heatmap(
+                x = job['x'],
+                y = job['y'],
+                z = job['z'],
+                colorbar = {'title': 'bar_g'}
+            )
+        ],
+        'layout' : {
+            'xaxis': {'title': SWEEP_PARAMETERS[job['x_name']][0]},
+            'yaxis': {'title': SWEEP_PARAMETERS[job['y_name']][0]}
+        }
+    }, status, job['rendered']
+
 if __name__ == '__main__':
-    app.run_server(port = 4051)
\ No newline at end of file
+    if os.environ.get('SCRATCH_WARM_UP'):
+        warm_up()
+    app.run_server(port = 4051)
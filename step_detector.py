@@ -0,0 +1,190 @@
+"""
+online detection of dose steps in pressure decay runs
+
+A dose shows up in the pressure log as a settled level (Pi), a jump as the
+reference cell is charged, a settled charge level (Pc), a jump the other
+way as the valve to the sample cell opens, and a decay towards equilibrium
+(Pe). EquilibriumStepDetector consumes samples one at a time or in chunks,
+keeps a least squares line through the last window samples with running
+sums, so every sample costs O(1), and calls a level settled when the slope
+of that line is within the drift tolerance. Each finished dose is returned
+as a DoseStep with the decay curve, ready for manometric_reduction,
+calibrate_specific_volume or the kinetic fits.
+"""
+from array import array
+from collections import deque, namedtuple
+
+DoseStep = namedtuple('DoseStep', ['initial_pressure', 'charge_pressure', 'equilibrium_pressure',
+                                   'start_time', 'time', 'pressure'])
+
+
+class RollingDrift(object):
+    """slope and mean of the last window samples, updated in O(1) per sample"""
+
+    def __init__(self, window):
+        self.window = window
+        self.reset()
+
+    def reset(self):
+        self.samples = deque()
+        self.origin = None
+        self.removed = 0
+        self.st = self.sp = self.stt = self.stp = 0.0
+
+    def _resum(self):
+        # running sums lose precision as samples leave, so rebuild them once per window
+        self.origin = self.samples[0][0]
+        self.st = self.sp = self.stt = self.stp = 0.0
+        for t, p in self.samples:
+            t -= self.origin
+            self.st += t
+            self.sp += p
+            self.stt += t*t
+            self.stp += t*p
+        self.removed = 0
+
+    def add(self, t, p):
+        if self.origin is None:
+            self.origin = t
+        self.samples.append((t, p))
+        t -= self.origin
+        self.st += t
+        self.sp += p
+        self.stt += t*t
+        self.stp += t*p
+        if len(self.samples) > self.window:
+            t_old, p_old = self.samples.popleft()
+            t_old -= self.origin
+            self.st -= t_old
+            self.sp -= p_old
+            self.stt -= t_old*t_old
+            self.stp -= t_old*p_old
+            self.removed += 1
+            if self.removed >= self.window:
+                self._resum()
+
+    @property
+    def full(self):
+        return len(self.samples) >= self.window
+
+    @property
+    def mean(self):
+        return self.sp/len(self.samples) if self.samples else float('nan')
+
+    @property
+    def slope(self):
+        n = len(self.samples)
+        denominator = n*self.stt - self.st*self.st
+        if n < 2 or denominator <= 0:
+            return float('nan')
+        return (n*self.stp - self.st*self.sp)/denominator
+
+
+class EquilibriumStepDetector(object):
+    """segment a live pressure log into dose steps
+
+    Arguments:
+        jump {float} -- smallest pressure change from the settled level that counts as a charge or expansion
+        drift {float} -- largest |dP/dt| of a settled level, pressure units per time unit
+
+    Keyword Arguments:
+        window {int} -- samples in the rolling drift window (default: {1000})
+    """
+
+    def __init__(self, jump, drift, window=1000):
+        self.jump = jump
+        self.drift = drift
+        self.rolling = RollingDrift(window)
+        self.state = 'settling'
+        self.level = float('nan')
+        self.initial_pressure = float('nan')
+        self.charge_pressure = float('nan')
+        self.direction = 0
+        self.previous = None
+        self.start_time = None
+        self.decay_time = array('d')
+        self.decay_pressure = array('d')
+
+    def _settled(self):
+        if self.rolling.full and abs(self.rolling.slope) <= self.drift:
+            # the last settled level, so a slow start of a jump does not leak into Pi or Pc
+            self.level = self.rolling.mean
+            return True
+        return False
+
+    def update(self, t, p):
+        """consume one sample
+
+        Returns:
+            DoseStep or None -- the dose that reached equilibrium with this sample
+        """
+        rolling = self.rolling
+        state = self.state
+        step = None
+        if state in ('settling', 'equilibrium'):
+            deviation = p - rolling.mean if rolling.samples else 0.0
+            if abs(deviation) > self.jump:
+                # charge: the settled level before the jump is Pi
+                self.initial_pressure = self.level if state == 'equilibrium' else self.previous
+                self.direction = 1 if deviation > 0 else -1
+                self.state = 'charging'
+                rolling.reset()
+            elif self._settled():
+                self.state = 'equilibrium'
+        elif state in ('charging', 'charged'):
+            if rolling.samples and self.direction*(rolling.mean - p) > self.jump:
+                # expansion into the sample cell: Pc is the charged level before it
+                self.charge_pressure = self.level if state == 'charged' else self.previous
+                self.state = 'decay'
+                self.start_time = t
+                del self.decay_time[:]
+                del self.decay_pressure[:]
+                rolling.reset()
+            elif self._settled():
+                self.state = 'charged'
+        if self.state == 'decay':
+            self.decay_time.append(t - self.start_time)
+            self.decay_pressure.append(p)
+        rolling.add(t, p)
+        if self.state == 'decay' and self._settled():
+            step = DoseStep(self.initial_pressure, self.charge_pressure, rolling.mean, self.start_time,
+                            _to_numpy(self.decay_time), _to_numpy(self.decay_pressure))
+            self.state = 'equilibrium'
+        self.previous = p
+        return step
+
+    def update_many(self, t, p):
+        """consume a chunk of samples
+
+        Arguments:
+            t {iterable} -- sample times
+            p {iterable} -- sample pressures
+
+        Returns:
+            list -- DoseStep of every dose that reached equilibrium in the chunk
+        """
+        if hasattr(t, 'tolist'):
+            t = t.tolist()
+        if hasattr(p, 'tolist'):
+            p = p.tolist()
+        update = self.update
+        steps = []
+        for t_i, p_i in zip(t, p):
+            step = update(t_i, p_i)
+            if step is not None:
+                steps.append(step)
+        return steps
+
+
+def _to_numpy(values):
+    import numpy as np
+    return np.array(values, dtype=float)
+
+
+def dose_pressures(steps):
+    """initial, charge and equilibrium pressure arrays of a sequence of DoseStep"""
+    import numpy as np
+    Pi = np.array([s.initial_pressure for s in steps], dtype=float)
+    Pc = np.array([s.charge_pressure for s in steps], dtype=float)
+    Pe = np.array([s.equilibrium_pressure for s in steps], dtype=float)
+    return Pi, Pc, Pe
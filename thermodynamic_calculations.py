@@ -1,36 +1,64 @@
-def calculate_pseudo_saturation_pressure(method,gas,temperature):
-    import CoolProp.CoolProp as cp
-    Tc = cp.PropsSI('TCRIT',gas)
-    Pc = cp.PropsSI('PCRIT',gas)
-    if (type(method) == int) or type(method) == float:
-        Ps = method
+import instrumentation
+from lazy_imports import lazy_import
+
+CP = lazy_import('CoolProp.CoolProp')
+
+
+def calculate_pseudo_saturation_pressure(method,gas,temperature,k=None):
+    """pseudo saturation pressure P0 above the critical temperature
+    
+    Arguments:
+        method {str or float} -- dubinin, amankwah, reduced_kirchoff, or a fixed P0 in Pa
+        gas {str} -- CoolProp fluid name
+        temperature {float or array_like} -- temperature K
+    
+    Keyword Arguments:
+        k {float} -- exponent of the amankwah method, P0 = Pc*(T/Tc)^k (default: {None})
+    
+    Returns:
+        float or numpy array -- P0 in Pa, one per temperature
+    """
+    import numpy as np
+    from fluid_constants import get_fluid_constants
+    constants = get_fluid_constants(gas)
+    Tc = constants.critical_temperature
+    Pc = constants.critical_pressure
+    T = np.asarray(temperature, dtype=float)
+    if isinstance(method, (int, float)):
+        Ps = np.full(T.shape, float(method))
     elif method == 'dubinin':
-        T = temperature
         Ps = Pc*(T/Tc)**2
     elif method == 'amankwah':
-        T = temperature
-        k = input('enter k for amankwah :')
+        if k is None:
+            raise ValueError('the amankwah method needs k')
         Ps = Pc*(T/Tc)**k
     elif method == 'reduced_kirchoff':
-        import numpy as np
-        Tnbp = cp.PropsSI('T', 'P', 101325, 'Q', 0, gas)
-        T = temperature
+        Tnbp = constants.normal_boiling_point
+        if Tnbp is None:
+            raise ValueError('{} has no normal boiling point for the reduced_kirchoff method'.format(gas))
         Ps = Pc*np.exp((Tnbp/Tc)*(np.log(Pc)/(1-(Tnbp/Tc)))*(1-(Tc/T)))
     else:
-        print('invalid method specified to calculate Ps; using dubinin method')
-        T = temperature
+        import warnings
+        warnings.warn('invalid method {} specified to calculate Ps; using dubinin method'.format(method))
         Ps = Pc*(T/Tc)**2
-    print('P0 set as {}'.format(Ps))
+    if Ps.ndim == 0:
+        return float(Ps)
     return Ps
 
-def get_z(pressure, temperature, gas):
-    import CoolProp.CoolProp as CP
+@instrumentation.instrument(label=lambda pressure, temperature, gas, backend='coolprop': '{} {}'.format(gas, backend))
+def get_z(pressure, temperature, gas, backend='coolprop'):
+    if backend == 'table':
+        from property_tables import table_z
+        return table_z(pressure, temperature, gas)
+    if backend == 'state':
+        from property_service import state_z
+        return state_z(pressure, temperature, gas)
     z = CP.PropsSI('Z','P',pressure,'T',temperature,gas)
     return z
 
-def get_rhom(pressure, temperature, gas):
-    import CoolProp.CoolProp as CP
-    z = CP.PropsSI('Z','P',pressure,'T',temperature,gas)
+@instrumentation.instrument(label=lambda pressure, temperature, gas, backend='coolprop': '{} {}'.format(gas, backend))
+def get_rhom(pressure, temperature, gas, backend='coolprop'):
+    z = get_z(pressure, temperature, gas, backend)
     R = 8.3144598
     rhom = pressure/(z*R*temperature)
-    return rhom
\ No newline at end of file
+    return rhom